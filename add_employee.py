@@ -3,10 +3,11 @@ from supabase import create_client, Client
 from datetime import datetime
 import uuid
 import os
-from werkzeug.security import generate_password_hash
 
 # Import the shared decorator
 from decorators import login_required
+from resilience import client_options
+from passwords import hash_password
 
 add_employee_bp = Blueprint('add_employee_bp', __name__)
 
@@ -15,7 +16,7 @@ add_employee_bp = Blueprint('add_employee_bp', __name__)
 # For now, this will work, but it's not ideal.
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=client_options())
 
 
 # ----------------------------------------------
@@ -57,7 +58,7 @@ def add_employee_submit():
             return redirect(url_for("add_employee_bp.add_employee_form"))
 
         # --- FIX: Hash the password ---
-        hashed_password = generate_password_hash(password)
+        hashed_password = hash_password(password)
 
         data = {
             'id': str(uuid.uuid4()),
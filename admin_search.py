@@ -0,0 +1,90 @@
+from flask import Blueprint, render_template, request, flash
+from supabase import create_client, Client
+from markupsafe import escape, Markup
+from datetime import datetime, timedelta
+import os
+
+# Import the shared decorator
+from decorators import login_required
+from resilience import client_options
+
+admin_search_bp = Blueprint('admin_search_bp', __name__)
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=client_options())
+
+PAGE_SIZE = 20
+KINDS = ('all', 'complaint', 'feedback')
+COMPLAINT_STATUSES = ('pending', 'in_progress', 'resolved')
+
+
+# --- JINJA TEMPLATE FILTER ---
+def highlight_snippet(value):
+    """Turns the ⟦ ⟧ match markers from ts_headline into <mark> tags, escaping everything else."""
+    if not value:
+        return ""
+    return Markup(str(escape(value)).replace('⟦', '<mark>').replace('⟧', '</mark>'))
+
+admin_search_bp.app_template_filter('highlight_snippet')(highlight_snippet)
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+
+@admin_search_bp.route('/admin/search')
+@login_required(role='admin')
+def search_submissions():
+    """
+    Ranked full-text search over complaints and feedback.
+    Matching, ranking and pagination all happen in Postgres
+    (see sql/003_submission_search.sql).
+    """
+    query = request.args.get('q', '').strip()
+    kind = request.args.get('kind', 'all')
+    status = request.args.get('status') or None
+    date_from = _parse_date(request.args.get('from'))
+    date_to = _parse_date(request.args.get('to'))
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    if kind not in KINDS:
+        kind = 'all'
+
+    results = []
+    total = 0
+    if query:
+        try:
+            response = supabase.rpc('search_submissions', {
+                'q': query,
+                'kind': kind,
+                'status_filter': status,
+                'date_from': date_from.isoformat() if date_from else None,
+                # 'to' is inclusive of the whole day
+                'date_to': (date_to + timedelta(days=1)).isoformat() if date_to else None,
+                'page_size': PAGE_SIZE,
+                'page_offset': (page - 1) * PAGE_SIZE
+            }).execute()
+            results = response.data or []
+            if results:
+                total = results[0]['total_count']
+        except Exception as e:
+            flash(f"Error searching submissions: {e}", "error")
+
+    return render_template(
+        'admin_search.html',
+        query=query,
+        kind=kind,
+        status=status,
+        date_from=request.args.get('from', ''),
+        date_to=request.args.get('to', ''),
+        results=results,
+        total=total,
+        page=page,
+        pages=(total + PAGE_SIZE - 1) // PAGE_SIZE,
+        kinds=KINDS,
+        statuses=COMPLAINT_STATUSES
+    )
@@ -2,13 +2,17 @@ from flask import Flask, render_template, request, redirect, url_for, flash, ses
 from supabase import create_client, Client
 from datetime import timedelta
 from dotenv import load_dotenv
-import os, uuid, json
-from werkzeug.security import generate_password_hash, check_password_hash
+import os, uuid
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dateutil import parser
+import click
 import re
 
 # Import the new decorator
 from decorators import login_required
+from page_cache import cache_anonymous_page
+from resilience import client_options, resilient_call, is_upstream_failure
+from passwords import hash_password, verify_password, PasswordServiceBusy
 
 # Load environment variables
 load_dotenv()
@@ -16,11 +20,25 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'wavelink-secret-key-change-this')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
+# Render terminates TLS at its proxy; trust one hop so request.remote_addr is the client
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1)
+
+# Fingerprinted, precompressed static files (see assets.py)
+from assets import init_assets
+init_assets(app)
+
+# orjson-backed jsonify when available (see json_provider.py)
+from json_provider import init_json
+init_json(app)
+
+# Sessions are stored server-side; the cookie only carries an id (see sessions.py)
+from sessions import init_sessions, regenerate_session, revoke_user_sessions
+init_sessions(app)
 
 # Supabase configuration
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=client_options())
 
 # Import blueprints
 from add_employee import add_employee_bp
@@ -32,10 +50,30 @@ app.register_blueprint(passenger_bp, url_prefix='/passenger')
 from employee_features import employee_bp
 app.register_blueprint(employee_bp, url_prefix='/employee')
 
+from admin_search import admin_search_bp
+app.register_blueprint(admin_search_bp)
+
+from journey_planner import journey_bp
+app.register_blueprint(journey_bp)
+
+from timetable import timetable_bp
+app.register_blueprint(timetable_bp)
+
+from demand import demand_bp
+app.register_blueprint(demand_bp)
+
+from rollups import rollups_bp
+app.register_blueprint(rollups_bp)
+
+# Background thread that pushes queued submissions to Supabase (see outbox.py)
+import outbox
+outbox.start_flusher(supabase)
+
 # ---------------------------------
 # Root route
 # ---------------------------------
 @app.route('/')
+@cache_anonymous_page()
 def index():
     if 'user_id' in session:
         role = session.get('role')
@@ -48,20 +86,33 @@ def index():
     # If not logged in, or no role, show landing
     return render_template('landing.html') 
 
+# Send a duplicate live-map read if the first hasn't answered by then (seconds)
+LIVE_MAP_HEDGE_AFTER = float(os.getenv('LIVE_MAP_HEDGE_AFTER', 0.25))
+
 @app.route('/api/live_map_data')
 def live_map_data():
-    # Fetch active terminals with coordinates
-    terminals_data = supabase.table("terminals").select("*").eq("is_active", True).execute()
-    terminals = terminals_data.data
+    try:
+        # Fetch active terminals with coordinates
+        terminals_data = resilient_call(
+            lambda: supabase.table("terminals").select("*").eq("is_active", True).execute(),
+            timeout=3, retries=1, hedge_after=LIVE_MAP_HEDGE_AFTER, stale_key='live_map_terminals'
+        )
+        terminals = terminals_data.data
 
-    # If you have routes table, add this too
-    routes_data = supabase.table("routes").select("*").execute()
-    routes = routes_data.data
+        # If you have routes table, add this too
+        routes_data = resilient_call(
+            lambda: supabase.table("routes").select("*").execute(),
+            timeout=3, retries=1, hedge_after=LIVE_MAP_HEDGE_AFTER, stale_key='live_map_routes'
+        )
+        routes = routes_data.data
+    except Exception as e:
+        return jsonify({"error": f"Map data unavailable: {e}"}), 503
 
     return jsonify({"terminals": terminals, "routes": routes})
 
 
 @app.route('/live_map')
+@cache_anonymous_page()
 def live_map():
     return render_template("live_map.html")
 
@@ -69,6 +120,7 @@ def live_map():
 # Passenger registration
 # ---------------------------------
 @app.route("/register", methods=["GET", "POST"])
+@cache_anonymous_page()
 def register():
     if request.method == "POST":
         full_name = request.form.get("full_name")
@@ -88,7 +140,11 @@ def register():
             return redirect(url_for("register"))
 
         # Hash the password
-        hashed_password = generate_password_hash(password)
+        try:
+            hashed_password = hash_password(password)
+        except PasswordServiceBusy:
+            flash("We're handling a lot of requests, please try again in a moment.", "error")
+            return redirect(url_for("register"))
 
         data = {
             "full_name": full_name,
@@ -112,6 +168,7 @@ def register():
 # Login
 # ---------------------------------
 @app.route('/login', methods=['GET', 'POST'])
+@cache_anonymous_page()
 def login():
     if request.method == 'POST':
         email = request.form.get('email')
@@ -121,7 +178,18 @@ def login():
             flash('Email and password are required', 'error')
             return redirect(url_for('login'))
 
-        result = supabase.table('users').select('*').eq('email', email).limit(1).execute()
+        try:
+            result = resilient_call(
+                lambda: supabase.table('users').select('*').eq('email', email).limit(1).execute(),
+                retries=1
+            )
+        except Exception as e:
+            print(f"Error looking up user for login: {e}")
+            if is_upstream_failure(e):
+                flash('Login is temporarily unavailable, please try again shortly.', 'error')
+            else:
+                flash('Login failed, please try again.', 'error')
+            return redirect(url_for('login'))
 
         if not result.data:
             flash('Invalid email or password', 'error')
@@ -130,13 +198,28 @@ def login():
         user = result.data[0]
 
         # Check the hashed password
-        if user.get('password') and check_password_hash(user['password'], password):
+        try:
+            valid, new_hash = verify_password(user.get('password'), password)
+        except PasswordServiceBusy:
+            flash('Login is busy right now, please try again in a moment.', 'error')
+            return redirect(url_for('login'))
+
+        if valid:
+            if new_hash:
+                # Hash parameters changed since this password was set
+                try:
+                    supabase.table('users').update({'password': new_hash}).eq('id', user['id']).execute()
+                except Exception as e:
+                    print(f"Error rehashing password for user {user['id']}: {e}")
+
+            regenerate_session()
             session.permanent = True
             session['user_id'] = user['id']
             session['email'] = user['email']
             session['full_name'] = user['full_name']
             session['role'] = user['role']
             session['employee_category'] = user.get('employee_category')
+            session['terminal_id'] = user.get('terminal_id')
 
             flash(f'Welcome back, {user["full_name"]}!', 'success')
 
@@ -157,6 +240,7 @@ def login():
 @app.route('/logout')
 def logout():
     session.clear()
+    regenerate_session()  # the flash below must not reuse the logged-in session id
     flash('You have been logged out successfully', 'success')
     return redirect(url_for('index'))
 
@@ -223,10 +307,13 @@ def change_password():
             flash("Password changed successfully.", "success")
         except:
             # If not using Supabase Auth, update your local users table hash
-            hashed = generate_password_hash(new_password)
+            hashed = hash_password(new_password)
             supabase.table('users').update({'password': hashed}).eq('id', session.get('user_id')).execute()
             flash("Password changed successfully.", "success")
 
+        # Sign the account out everywhere else
+        revoke_user_sessions(session.get('user_id'), keep_current=True)
+
     except Exception as e:
         flash(f"Error changing password: {e}", "error")
         
@@ -243,7 +330,7 @@ def download_data():
         user_data = user_res.data
         
         # Convert to JSON string
-        json_str = json.dumps(user_data, indent=4, default=str)
+        json_str = app.json.dumps(user_data, indent=2)
         
         # Create file download response
         return Response(
@@ -293,6 +380,54 @@ def passenger_dashboard():
 
 # --- REMOVED THE DUPLICATE PROFILE ROUTE THAT WAS HERE ---
 
+# ---------------------------------
+# Maintenance commands
+# ---------------------------------
+@app.cli.command('sweep-blobs')
+def sweep_blobs_command():
+    """Deletes uploaded blobs that are no longer referenced by any row."""
+    from blob_store import sweep_orphaned_blobs
+    removed = sweep_orphaned_blobs(supabase)
+    print(f"Removed {len(removed)} orphaned blob(s).")
+
+
+@app.cli.command('refresh-rollups')
+def refresh_rollups_command():
+    """Folds new accidents and repairs into the admin dashboard rollups."""
+    from rollups import refresh_rollups
+    for result in refresh_rollups():
+        print(f"{result['source']}: {result['buckets_updated']} bucket(s) updated.")
+
+
+@app.cli.command('outbox-parked')
+def outbox_parked_command():
+    """Lists queued submissions that Supabase rejected or that ran out of retries."""
+    rows = outbox.parked_rows()
+    for seq, table_name, attempts, last_error, created_at, payload in rows:
+        print(f"#{seq} {table_name} ({attempts} attempt(s)): {last_error}\n    {payload}")
+    print(f"{len(rows)} parked row(s).")
+
+
+@app.cli.command('outbox-replay')
+@click.argument('seqs', nargs=-1, type=int)
+def outbox_replay_command(seqs):
+    """Requeues parked submissions (all of them, or the given #seq numbers)."""
+    print(f"Requeued {outbox.replay_parked(seqs)} row(s).")
+
+
+@app.cli.command('revoke-sessions')
+@click.argument('user')
+def revoke_sessions_command(user):
+    """Logs a user (id or email) out of every session."""
+    user_id = user
+    if '@' in user:
+        result = supabase.table('users').select('id').eq('email', user).limit(1).execute()
+        if not result.data:
+            raise click.ClickException(f"No user with email {user}")
+        user_id = result.data[0]['id']
+    count = app.session_interface.revoke_user(user_id)
+    print(f"Revoked {count} session(s) for user {user_id}.")
+
 @app.template_filter('format_datetime')
 def format_datetime(value, format='%Y-%m-%d %H:%M'):
     if value is None:
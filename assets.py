@@ -0,0 +1,117 @@
+from flask import request, send_from_directory
+import hashlib
+import gzip
+import json
+import mimetypes
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:  # .br variants are skipped without the Brotli package
+    brotli = None
+
+# --- Static asset pipeline ---
+# `flask build-assets` copies every file in static/ to
+# static/dist/<name>.<hash><ext>, writes .gz/.br variants next to it and
+# records the mapping in static/dist/manifest.json. url_for('static', ...)
+# then points at the fingerprinted copy, which is served precompressed
+# with an immutable cache header.
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 12
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.json', '.geojson', '.svg', '.txt', '.html')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+mimetypes.add_type('application/geo+json', '.geojson')
+
+
+def build_assets(static_folder):
+    """Fingerprints and precompresses everything in static/. Returns the manifest."""
+    dist_folder = os.path.join(static_folder, DIST_DIR)
+    if os.path.isdir(dist_folder):
+        shutil.rmtree(dist_folder)
+    os.makedirs(dist_folder)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder) and DIST_DIR in dirs:
+            dirs.remove(DIST_DIR)
+        for name in files:
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_folder).replace(os.sep, '/')
+
+            with open(source, 'rb') as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+            stem, ext = os.path.splitext(logical)
+            fingerprinted = f"{DIST_DIR}/{stem}.{digest}{ext}"
+
+            target = os.path.join(static_folder, fingerprinted)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+
+            if ext.lower() in COMPRESSIBLE_EXTENSIONS:
+                with open(target + '.gz', 'wb') as f:
+                    f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(target + '.br', 'wb') as f:
+                        f.write(brotli.compress(data, quality=11))
+
+            manifest[logical] = fingerprinted
+
+    with open(os.path.join(dist_folder, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def init_assets(app):
+    """
+    Wires the fingerprinted assets into the app. Without a manifest (e.g. in
+    development before `flask build-assets`) static files are served as before.
+    """
+    manifest = load_manifest(app.static_folder)
+    fingerprinted = set(manifest.values())
+    original_static_view = app.view_functions['static']
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = manifest.get(values['filename'], values['filename'])
+
+    def static_view(filename):
+        if filename not in fingerprinted:
+            return original_static_view(filename=filename)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        served, encoding = filename, None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            # quality, not membership: 'br;q=0' means the client refuses br
+            if request.accept_encodings[candidate] > 0 and \
+                    os.path.exists(os.path.join(app.static_folder, filename + suffix)):
+                served, encoding = filename + suffix, candidate
+                break
+
+        response = send_from_directory(app.static_folder, served, mimetype=mimetype, max_age=31536000)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = static_view
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Fingerprints and precompresses the files in static/."""
+        built = build_assets(app.static_folder)
+        print(f"Built {len(built)} asset(s) into {os.path.join(app.static_folder, DIST_DIR)}.")
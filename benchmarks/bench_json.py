@@ -0,0 +1,106 @@
+"""
+Compares JSON serialisation of real API payloads: the stdlib provider
+against the orjson one (see json_provider.py).
+
+    python benchmarks/bench_json.py              # live data from SUPABASE_URL
+    python benchmarks/bench_json.py --synthetic  # generated rows of the same shape
+"""
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+import argparse
+import os
+import random
+import sys
+import timeit
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from dotenv import load_dotenv
+from flask import Flask
+
+from json_provider import OrjsonProvider, StdlibJSONProvider, orjson
+
+
+def load_live_payloads():
+    from supabase import create_client
+    supabase = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'))
+    terminals = supabase.table('terminals').select('*').eq('is_active', True).execute().data
+    routes = supabase.table('routes').select('*').execute().data
+    feedbacks = supabase.table('feedbacks').select('*, attachments(*)').limit(500).execute().data
+    return terminals, routes, feedbacks
+
+
+def make_synthetic_payloads(terminal_count=60, feedback_count=500):
+    rng = random.Random(42)
+    now = datetime.now(timezone.utc)
+    terminals = [{
+        'id': str(uuid.uuid4()),
+        'name': f"Terminal {i}",
+        'latitude': 1.2 + rng.random(),
+        'longitude': 103.6 + rng.random(),
+        'is_active': True,
+        'created_at': (now - timedelta(days=rng.randint(0, 900))).isoformat()
+    } for i in range(terminal_count)]
+    routes = [{
+        'id': str(uuid.uuid4()),
+        'name': f"{a['name']} - {b['name']}",
+        'origin_terminal_id': a['id'],
+        'destination_terminal_id': b['id'],
+        'base_price': Decimal(rng.randint(150, 2500)) / 100,
+        'created_at': now - timedelta(days=rng.randint(0, 900))
+    } for a in terminals for b in rng.sample(terminals, 4) if a is not b]
+    feedbacks = [{
+        'id': uuid.uuid4(),
+        'passenger_id': str(uuid.uuid4()),
+        'subject': 'Ferry delay',
+        'message': 'The 08:30 departure left twenty minutes late again. ' * rng.randint(1, 6),
+        'submitted_at': now - timedelta(minutes=rng.randint(0, 100000)),
+        'attachments': [{
+            'file_url': f"https://example.supabase.co/storage/v1/object/public/pdfs/blobs/{uuid.uuid4().hex}.jpg",
+            'file_type': 'image/jpeg'
+        } for _ in range(rng.randint(0, 3))]
+    } for _ in range(feedback_count)]
+    return terminals, routes, feedbacks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--synthetic', action='store_true', help="don't query Supabase")
+    parser.add_argument('--number', type=int, default=200, help='serialisations per timing run')
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.synthetic or not os.getenv('SUPABASE_URL'):
+        terminals, routes, feedbacks = make_synthetic_payloads()
+        source = 'synthetic'
+    else:
+        terminals, routes, feedbacks = load_live_payloads()
+        source = 'live'
+
+    payloads = {
+        'live_map_data': {'terminals': terminals, 'routes': routes},
+        'feedbacks': {'feedbacks': feedbacks},
+    }
+    app = Flask(__name__)
+    providers = {'stdlib': StdlibJSONProvider(app)}
+    if orjson is not None:
+        providers['orjson'] = OrjsonProvider(app)
+    else:
+        print("orjson is not installed; timing the stdlib provider only")
+
+    print(f"{source} payloads: {len(terminals)} terminals, {len(routes)} routes, {len(feedbacks)} feedbacks")
+    for name, payload in payloads.items():
+        size = len(providers['stdlib'].dumps(payload).encode('utf-8'))
+        results = {}
+        for provider_name, provider in providers.items():
+            best = min(timeit.repeat(lambda: provider.dumps(payload), number=args.number, repeat=5))
+            results[provider_name] = best / args.number * 1e6
+        line = ', '.join(f"{p}: {us:8.1f} us" for p, us in results.items())
+        if 'orjson' in results:
+            line += f"  ({results['stdlib'] / results['orjson']:.1f}x)"
+        print(f"{name:15} {size / 1024:7.1f} KiB  {line}")
+
+
+if __name__ == '__main__':
+    main()
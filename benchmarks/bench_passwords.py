@@ -0,0 +1,73 @@
+"""
+Measures logins per second per core for password hashing settings, i.e.
+how many verify_password() calls one CPU core can do (see passwords.py).
+
+    python benchmarks/bench_passwords.py
+    python benchmarks/bench_passwords.py --method scrypt:16384:8:1 --method pbkdf2:sha256:600000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import passwords
+
+DEFAULT_METHODS = ('scrypt:16384:8:1', 'scrypt:32768:8:1', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:1000000')
+
+
+def logins_per_second(stored_hash, password, seconds):
+    """Inline verification on this thread: one core's throughput."""
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        check_password_hash(stored_hash, password)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def service_logins_per_second(stored_hash, password, seconds):
+    """Through the bounded executor with one caller per hashing thread."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def caller():
+        count = 0
+        while time.perf_counter() < deadline:
+            try:
+                passwords.verify_password(stored_hash, password)
+                count += 1
+            except passwords.PasswordServiceBusy:
+                pass
+        return count
+
+    deadline = time.perf_counter() + seconds
+    with ThreadPoolExecutor(max_workers=passwords.PASSWORD_HASH_THREADS) as callers:
+        total = sum(callers.map(lambda _: caller(), range(passwords.PASSWORD_HASH_THREADS)))
+    return total / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--method', action='append', help='werkzeug hash method (repeatable)')
+    parser.add_argument('--seconds', type=float, default=3.0, help='time per measurement')
+    args = parser.parse_args()
+
+    password = 'correct horse battery staple'
+    print(f"{os.cpu_count()} cores, {passwords.PASSWORD_HASH_THREADS} hashing threads, "
+          f"configured method {passwords.PASSWORD_HASH_METHOD}")
+    for method in args.method or DEFAULT_METHODS:
+        stored_hash = generate_password_hash(password, method)
+        per_core = logins_per_second(stored_hash, password, args.seconds)
+        print(f"{method:24} {per_core:8.1f} logins/s/core  {1000 / per_core:7.1f} ms/login")
+
+    stored_hash = generate_password_hash(password, passwords.PASSWORD_HASH_METHOD)
+    total = service_logins_per_second(stored_hash, password, args.seconds)
+    print(f"password service ({passwords.PASSWORD_HASH_METHOD}): {total:.1f} logins/s across "
+          f"{passwords.PASSWORD_HASH_THREADS} threads")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import hashlib
+import os
+
+from image_derivatives import VARIANTS, derivative_path
+from outbox import enqueue, register_handler, write_spool, read_spool, remove_spool
+from resilience import resilient_call
+
+# --- Content-addressed upload storage ---
+# Uploads are stored once per distinct content under blobs/<sha256><ext>.
+# The `blobs` table records what is in the bucket and `blob_refs` records
+# which rows point at each blob (see sql/002_blob_store.sql); deleting an
+# owning row drops its references (sql/010_blob_ref_triggers.sql). Blobs that
+# lose all their references are only removed, with their image derivatives,
+# by sweep_orphaned_blobs() after a grace period, so a blob that is being
+# re-used is never deleted under it.
+#
+# stage_blob() is for uploads that belong to queued rows: when storage is
+# unreachable the bytes are spooled to local disk and a 'storage:blobs' job is
+# queued ahead of the rows that use the blob, so the outbox uploads it first.
+BUCKET = 'pdfs'
+BLOB_DIR = 'blobs'
+CHUNK_SIZE = 1024 * 1024
+UPLOAD_TIMEOUT = 30.0  # seconds before a request gives up and spools the upload
+STAGED_BLOBS = 'storage:blobs'  # outbox handler table
+
+
+def _read_and_hash(file):
+    """Reads an uploaded file in chunks, hashing it in the same pass."""
+    hasher = hashlib.sha256()
+    chunks = []
+    file.seek(0)
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        chunks.append(chunk)
+    return hasher.hexdigest(), b''.join(chunks)
+
+
+def public_url(supabase, path):
+    res_url = supabase.storage.from_(BUCKET).get_public_url(path)
+    return res_url if isinstance(res_url, str) else res_url.public_url
+
+
+def store_blob(supabase, file, content_type=None):
+    """
+    Stores an uploaded file (werkzeug FileStorage) by content hash.
+    The upload is skipped if the same bytes are already in the bucket.
+    Returns a dict with sha256, path, size, content_type, data and
+    'uploaded' (False when an existing blob was re-used).
+    """
+    content_type = content_type or file.mimetype or 'application/octet-stream'
+    sha256, data = _read_and_hash(file)
+    path, uploaded = _store(supabase, sha256, data, _blob_path(sha256, file), content_type)
+    return {
+        'sha256': sha256,
+        'path': path,
+        'size': len(data),
+        'content_type': content_type,
+        'data': data,
+        'uploaded': uploaded
+    }
+
+
+def _blob_path(sha256, file):
+    file_ext = os.path.splitext(file.filename or '')[1].lower()
+    return f"{BLOB_DIR}/{sha256}{file_ext}"
+
+
+def _store(supabase, sha256, data, path, content_type):
+    """Uploads data unless the blob exists. Returns (path, uploaded)."""
+    # Look up and revive in one statement: if the sweeper deleted the row
+    # first, the update matches nothing and the bytes are uploaded again
+    revived = supabase.table('blobs').update({'orphaned_at': None}).eq('sha256', sha256).execute()
+    if revived.data:
+        return revived.data[0]['path'], False
+    # upsert: another worker may have stored the same bytes a moment ago
+    supabase.storage.from_(BUCKET).upload(path, data, {"content-type": content_type, "upsert": "true"})
+    supabase.table('blobs').upsert({
+        'sha256': sha256,
+        'path': path,
+        'size': len(data),
+        'content_type': content_type
+    }, on_conflict='sha256', ignore_duplicates=True).execute()
+    return path, True
+
+
+def stage_blob(supabase, file, content_type=None):
+    """
+    Like store_blob(), but never fails because storage is down: the bytes
+    are spooled locally instead and the result has 'spooled': True. Queue
+    result['outbox_rows'] in the same enqueue_rows() call as, and before,
+    the rows that refer to result['path'].
+    """
+    content_type = content_type or file.mimetype or 'application/octet-stream'
+    sha256, data = _read_and_hash(file)
+    path = _blob_path(sha256, file)
+    blob = {'sha256': sha256, 'size': len(data), 'content_type': content_type, 'data': data}
+    try:
+        stored_path, uploaded = resilient_call(
+            lambda: _store(supabase, sha256, data, path, content_type),
+            upstream='storage', timeout=UPLOAD_TIMEOUT
+        )
+        return dict(blob, path=stored_path, uploaded=uploaded, spooled=False, outbox_rows=[])
+    except Exception as e:
+        print(f"Spooling upload {sha256} for the outbox: {e}")
+    write_spool(sha256, data)
+    job = {'sha256': sha256, 'path': path, 'size': len(data), 'content_type': content_type}
+    return dict(blob, path=path, uploaded=False, spooled=True, outbox_rows=[(STAGED_BLOBS, job, 'sha256')])
+
+
+def _deliver_staged(supabase, jobs):
+    """Outbox handler for spooled uploads; safe to run more than once."""
+    for job in jobs:
+        data = read_spool(job['sha256'])
+        if data is None:
+            # Delivered by an earlier attempt that was not acknowledged
+            continue
+        stored_path, _ = _store(supabase, job['sha256'], data, job['path'], job['content_type'])
+        if stored_path != job['path']:
+            # Same bytes under another extension: the queued rows link to job['path']
+            supabase.storage.from_(BUCKET).upload(
+                job['path'], data, {"content-type": job['content_type'], "upsert": "true"}
+            )
+        remove_spool(job['sha256'])
+
+
+register_handler(STAGED_BLOBS, _deliver_staged)
+
+
+def blob_ref_row(sha256, owner):
+    """The outbox row add_blob_ref() queues, for batching with other rows."""
+    return ('blob_refs', {'sha256': sha256, 'owner': owner}, 'sha256,owner')
+
+
+def add_blob_ref(supabase, sha256, owner):
+    """Records (via the outbox) that `owner` (e.g. 'feedback:<id>') uses a blob."""
+    enqueue(*blob_ref_row(sha256, owner))
+
+
+def sweep_orphaned_blobs(supabase, grace_minutes=60):
+    """
+    Removes blobs that have had no references for longer than the grace
+    period, with their image derivatives. Returns the list of blob storage
+    paths that were deleted.
+    """
+    res = supabase.rpc('sweep_orphaned_blobs', {'grace_minutes': grace_minutes}).execute()
+    paths = [row['path'] for row in (res.data or [])]
+    if paths:
+        # A blob uploaded again since the rows were deleted keeps its file
+        live = supabase.table('blobs').select('path').in_('path', paths).execute()
+        live_paths = {row['path'] for row in (live.data or [])}
+        paths = [path for path in paths if path not in live_paths]
+    if paths:
+        sha256s = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+        derivatives = [derivative_path(sha256, variant) for sha256 in sha256s for variant in VARIANTS]
+        supabase.storage.from_(BUCKET).remove(paths + derivatives)
+    return paths
@@ -0,0 +1,197 @@
+from flask import Blueprint, render_template, redirect, url_for, flash, Response
+from supabase import create_client, Client
+import numpy as np
+import threading
+import time
+import csv
+import io
+import os
+
+from decorators import login_required
+from resilience import client_options, resilient_call
+from journey_planner import get_route_graph
+from timetable import get_timetable, parse_time, format_time
+
+demand_bp = Blueprint('demand_bp', __name__)
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=client_options())
+
+# Full rebuild interval; in between, saves and deletes in this worker update
+# the matrix in place. Other workers' changes show up at the next rebuild.
+# A routes/timetable refresh that adds or removes a route or slot also
+# triggers a rebuild; one that changes nothing the matrix depends on does not.
+DEMAND_REBUILD_TTL = int(os.getenv('DEMAND_REBUILD_TTL', 600))
+PAGE_SIZE = 1000  # PostgREST's default max rows per request
+TOP_N = 20
+
+
+def _slot(value):
+    """'08:00', '8:00' and '08:00:00' are the same slot."""
+    try:
+        return format_time(parse_time(value))
+    except (TypeError, ValueError):
+        return str(value)
+
+
+class DemandMatrix:
+    """
+    Passenger preferences counted into a routes x time-slots int32 matrix.
+    Row i is self.route_ids[i], column j is self.slots[j].
+    """
+
+    def __init__(self, routes, slots, preferences):
+        self.routes = {str(r['id']): r for r in routes}
+        self.route_ids = list(self.routes)
+        self.route_index = {route_id: i for i, route_id in enumerate(self.route_ids)}
+        pref_slots = [_slot(p['preferred_time']) for p in preferences]
+        self.slots = sorted({_slot(slot) for slot in slots} | set(pref_slots))
+        self.slot_index = {slot: j for j, slot in enumerate(self.slots)}
+
+        shape = (len(self.route_ids), len(self.slots))
+        rows = np.fromiter((self.route_index.get(str(p['route_id']), -1) for p in preferences),
+                           dtype=np.int64, count=len(preferences))
+        cols = np.fromiter((self.slot_index[slot] for slot in pref_slots),
+                           dtype=np.int64, count=len(preferences))
+        known = rows >= 0  # preferences for routes that no longer exist
+        flat = rows[known] * shape[1] + cols[known]
+        self.counts = np.bincount(flat, minlength=shape[0] * shape[1]).astype(np.int32).reshape(shape)
+
+    def record(self, route_id, slot, delta):
+        """Applies one saved (+1) or deleted (-1) preference. Returns False if it needs a rebuild."""
+        i = self.route_index.get(str(route_id))
+        j = self.slot_index.get(_slot(slot))
+        if i is None or j is None:
+            return False
+        self.counts[i, j] = max(0, self.counts[i, j] + delta)
+        return True
+
+    def peak_slots(self, n=TOP_N):
+        """The n busiest (route, slot) cells, busiest first."""
+        flat = self.counts.ravel()
+        n = min(n, int(np.count_nonzero(flat)))
+        if n == 0:
+            return []
+        top = np.argpartition(flat, -n)[-n:]
+        top = top[np.argsort(flat[top])[::-1]]
+        width = len(self.slots)
+        return [{
+            'route_id': self.route_ids[k // width],
+            'route_name': self.routes[self.route_ids[k // width]].get('name'),
+            'slot': self.slots[k % width],
+            'passengers': int(flat[k])
+        } for k in top]
+
+    def slot_totals(self):
+        return dict(zip(self.slots, self.counts.sum(axis=0).tolist()))
+
+    def to_csv(self):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(['route_id', 'route_name'] + self.slots + ['total'])
+        for i, route_id in enumerate(self.route_ids):
+            row = self.counts[i].tolist()
+            writer.writerow([route_id, self.routes[route_id].get('name')] + row + [sum(row)])
+        writer.writerow([])
+        writer.writerow(['rank', 'route_id', 'route_name', 'slot', 'passengers'])
+        for rank, peak in enumerate(self.peak_slots(), start=1):
+            writer.writerow([rank, peak['route_id'], peak['route_name'], peak['slot'], peak['passengers']])
+        return out.getvalue()
+
+
+# --- Demand cache ---
+# _cache_lock only guards the dict; the slow rebuild runs outside it so
+# record_preference_change never waits on Supabase. _rebuild_lock keeps
+# concurrent readers from rebuilding the same matrix twice.
+_cache = {'matrix': None, 'built_at': 0.0, 'shape_key': None, 'generation': 0}
+_cache_lock = threading.Lock()
+_rebuild_lock = threading.Lock()
+
+
+def _load_preferences():
+    preferences = []
+    start = 0
+    while True:
+        page = resilient_call(
+            lambda: supabase.table('passenger_preferences').select('route_id, preferred_time')
+                .order('id').range(start, start + PAGE_SIZE - 1).execute(),
+            retries=2
+        )
+        preferences.extend(page.data or [])
+        if len(page.data or []) < PAGE_SIZE:
+            return preferences
+        start += PAGE_SIZE
+
+
+def _is_current(shape_key):
+    return (_cache['matrix'] is not None and _cache['shape_key'] == shape_key
+            and time.monotonic() - _cache['built_at'] < DEMAND_REBUILD_TTL)
+
+
+def get_demand_matrix():
+    graph = get_route_graph()
+    slots = get_timetable().slots
+    shape_key = (tuple(str(r['id']) for r in graph.routes), tuple(slots))
+    with _cache_lock:
+        if _is_current(shape_key):
+            return _cache['matrix']
+
+    with _rebuild_lock:
+        with _cache_lock:
+            if _is_current(shape_key):  # another thread just rebuilt it
+                return _cache['matrix']
+            generation = _cache['generation']
+        matrix = DemandMatrix(graph.routes, slots, _load_preferences())
+        with _cache_lock:
+            # A save or delete landed during the load: it may or may not be in
+            # what was read, so serve this matrix but rebuild on the next read
+            fresh = _cache['generation'] == generation
+            _cache['matrix'] = matrix
+            _cache['shape_key'] = shape_key
+            _cache['built_at'] = time.monotonic() if fresh else 0.0
+        return matrix
+
+
+def record_preference_change(route_id, slot, delta):
+    """Keeps the cached matrix current after a preference is saved or deleted."""
+    with _cache_lock:
+        _cache['generation'] += 1
+        matrix = _cache['matrix']
+        if matrix is not None and not matrix.record(route_id, slot, delta):
+            _cache['matrix'] = None  # unknown route/slot: rebuild on next read
+
+
+# ---------------------------------------------------------------------------------------------------
+## Admin demand views
+# ---------------------------------------------------------------------------------------------------
+
+@demand_bp.route('/admin/demand')
+@login_required(role='admin')
+def demand_overview():
+    matrix = None
+    try:
+        matrix = get_demand_matrix()
+    except Exception as e:
+        flash(f"Error loading demand data: {e}", "error")
+
+    return render_template(
+        'admin_demand.html',
+        matrix=matrix,
+        peaks=matrix.peak_slots() if matrix else [],
+        slot_totals=matrix.slot_totals() if matrix else {}
+    )
+
+
+@demand_bp.route('/admin/demand.csv')
+@login_required(role='admin')
+def demand_csv():
+    try:
+        return Response(
+            get_demand_matrix().to_csv(),
+            mimetype="text/csv",
+            headers={"Content-disposition": "attachment; filename=wavelink_demand.csv"}
+        )
+    except Exception as e:
+        flash(f"Error exporting demand data: {e}", "error")
+        return redirect(url_for('demand_bp.demand_overview'))
@@ -1,20 +1,24 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 from supabase import create_client, Client
-from datetime import datetime
-import uuid
+from datetime import datetime, timezone
 import os
 import fitz  # PyMuPDF for PDF metadata extraction
 import re
 
 # Import the shared decorator
 from decorators import login_required
+from resilience import client_options, resilient_call
+from blob_store import store_blob, stage_blob, add_blob_ref, blob_ref_row, public_url
+from rate_limit import rate_limited
+from outbox import enqueue_rows, new_id
+from timetable import TIMETABLE_TZ
 
 employee_bp = Blueprint('employee_bp', __name__)
 
 # Re-create the Supabase client
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=client_options())
 
 # --- PDF EXTRACTION HELPER FUNCTIONS ---
 ISO_DATE_REGEX = r"(\d{4}-\d{1,2}-\d{1,2})" 
@@ -51,10 +55,20 @@ def format_datetime(value, format='%Y-%m-%d %H:%M'):
             value = datetime.fromisoformat(value.replace('Z', '+00:00'))
         except ValueError:
             return value
+    if value.tzinfo is not None:
+        value = value.astimezone(TIMETABLE_TZ)  # stored in UTC, shown in local time
     return value.strftime(format)
 
 employee_bp.app_template_filter('datetime_format')(format_datetime)
 
+
+def to_utc(local_value):
+    """A datetime-local form value (water metro local time) -> UTC ISO 8601."""
+    value = datetime.fromisoformat(local_value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=TIMETABLE_TZ)
+    return value.astimezone(timezone.utc).isoformat()
+
 # ---------------------------------------------------------------------------------------------------
 ## Employee Dashboard
 # ---------------------------------------------------------------------------------------------------
@@ -71,6 +85,7 @@ def employee_dashboard():
 
 @employee_bp.route('/upload_certificate', methods=['GET', 'POST'])
 @login_required(role='employee')
+@rate_limited('upload_certificate')
 def upload_certificate():
     # 1. AJAX Analysis
     if request.method == 'POST' and 'file_for_analysis' in request.files:
@@ -110,17 +125,12 @@ def upload_certificate():
 
             file = files[0]
             file_url = None
+            blob = None
             
             if file and file.filename:
-                file_ext = os.path.splitext(file.filename)[1]
-                # CHANGED: Removed user_id subfolder. Saving to root of bucket.
-                storage_file_name = f"cert_{uuid.uuid4()}{file_ext}"
-                
-                file.seek(0)
-                supabase.storage.from_('pdfs').upload(storage_file_name, file.read(), {"content-type": "application/pdf"})
-                
-                res_url = supabase.storage.from_('pdfs').get_public_url(storage_file_name)
-                file_url = res_url if isinstance(res_url, str) else res_url.public_url
+                # Re-uploading the same certificate re-uses the stored blob
+                blob = store_blob(supabase, file, "application/pdf")
+                file_url = public_url(supabase, blob['path'])
 
             if not file_url:
                 flash("File upload failed.", "error")
@@ -137,7 +147,8 @@ def upload_certificate():
                 "status": "pending"
             }
             
-            supabase.table('certificates').insert(cert_entry).execute()
+            cert_res = supabase.table('certificates').insert(cert_entry).execute()
+            add_blob_ref(supabase, blob['sha256'], f"certificate:{cert_res.data[0]['id']}")
 
             flash("Certificate submitted for verification!", "success")
             return redirect(url_for('employee_bp.my_certificates'))
@@ -172,8 +183,29 @@ def my_certificates():
 ## Accidents / Incidents
 # ---------------------------------------------------------------------------------------------------
 
+# The values the report form offers (and existing rows hold)
+INCIDENT_SEVERITIES = ('low', 'Medium', 'High')
+
+
+def _signed_url(blob):
+    """A 1-year signed URL for a stored blob, or None if storage can't give one now."""
+    if blob['spooled']:
+        return None
+    try:
+        res = supabase.storage.from_('pdfs').create_signed_url(blob['path'], 31536000) # 1 Year expiry
+    except Exception as e:
+        print(f"Error signing incident attachment URL: {e}")
+        return None
+    # Extract URL
+    if isinstance(res, dict) and 'signedURL' in res: return res['signedURL']
+    elif isinstance(res, str): return res
+    elif hasattr(res, 'signedURL'): return res.signedURL
+    return None
+
+
 @employee_bp.route('/report_incident', methods=['GET', 'POST'])
 @login_required(role='employee')
+@rate_limited('report_incident')
 def report_incident():
     if request.method == 'POST':
         try:
@@ -191,37 +223,33 @@ def report_incident():
             if not narrative or not subject or not accident_time:
                 flash("Subject, Description, and Time are required.", "error")
                 return redirect(url_for('employee_bp.report_incident'))
+            if severity not in INCIDENT_SEVERITIES:
+                flash(f"Severity must be one of: {', '.join(INCIDENT_SEVERITIES)}.", "error")
+                return redirect(url_for('employee_bp.report_incident'))
 
             # 2. Handle File Upload (Single file per your schema image)
+            accident_id = new_id()
             file_name = None
             file_url = None
+            blob = None
             
             if files and files[0].filename:
                 file = files[0]
-                file_ext = os.path.splitext(file.filename)[1]
-                storage_name = f"accident_{uuid.uuid4()}{file_ext}"
-                
-                # Upload
-                file.seek(0)
-                supabase.storage.from_('pdfs').upload(storage_name, file.read(), {"content-type": file.mimetype})
-                
-                # Generate Signed URL
-                res = supabase.storage.from_('pdfs').create_signed_url(storage_name, 31536000) # 1 Year expiry
-                
-                # Extract URL
-                if isinstance(res, dict) and 'signedURL' in res: file_url = res['signedURL']
-                elif isinstance(res, str): file_url = res
-                elif hasattr(res, 'signedURL'): file_url = res.signedURL
                 
+                # Upload (skipped if the same file is already stored; spooled
+                # for the outbox if storage is unreachable)
+                blob = stage_blob(supabase, file)
+                file_url = _signed_url(blob) or public_url(supabase, blob['path'])
                 file_name = file.filename
 
-            # 3. Insert into Database (Matches your Schema Image)
+            # 3. Queue for the Database (Matches your Schema Image)
             accident_entry = {
+                "id": accident_id,
                 "reported_by_id": user_id,
                 "terminal_id": "2e728c0f-ae27-4830-b5f7-139bfd0784ab", # Ensure this is a valid UUID in your DB
                 "subject": subject,
                 "narrative": narrative,
-                "accident_time": datetime.fromisoformat(accident_time).isoformat(),
+                "accident_time": to_utc(accident_time),
                 "severity": severity,
                 "involved_party": involved_party,
                 "status": "investigation",
@@ -230,7 +258,12 @@ def report_incident():
                 "uploaded_at": datetime.now().isoformat()
             }
             
-            supabase.table('accidents').insert(accident_entry).execute()
+            # Queued locally and pushed to Supabase by the outbox flusher,
+            # so a poor uplink does not lose the report or block the crew
+            rows = [('accidents', accident_entry)]
+            if blob:
+                rows += blob['outbox_rows'] + [blob_ref_row(blob['sha256'], f"accident:{accident_id}")]
+            enqueue_rows(rows)
 
             flash("Incident reported successfully!", "success")
             return redirect(url_for('employee_bp.my_incidents'))
@@ -260,50 +293,161 @@ def my_incidents():
 ## Repairs
 # ---------------------------------------------------------------------------------------------------
 
+REPAIR_PRIORITIES = ('critical', 'high', 'medium', 'low')
+
 @employee_bp.route('/upload_repair', methods=['POST'])
 @login_required(role='employee')
+@rate_limited('upload_repair')
 def upload_repair():
     try:
         user_id = session.get('user_id')
         terminal_id = session.get('terminal_id') 
         subject = request.form.get('subject') 
         description = request.form.get('description')
+        priority = request.form.get('priority', 'medium')
         files = request.files.getlist('attachments')
         
         if not subject or not description:
             flash("Repair title and description are required.", "error")
             return redirect(url_for('employee_bp.employee_dashboard'))
+        if priority not in REPAIR_PRIORITIES:
+            flash(f"Priority must be one of: {', '.join(REPAIR_PRIORITIES)}.", "error")
+            return redirect(url_for('employee_bp.employee_dashboard'))
+        if not terminal_id:
+            # The work queue is per terminal; a repair without one would never be picked up
+            flash("Your account is not assigned to a terminal, so repairs can't be reported yet. "
+                  "Please contact an administrator.", "error")
+            return redirect(url_for('employee_bp.employee_dashboard'))
 
-        file_urls_text = ""
-        if files:
-            for file in files:
-                if file.filename:
-                    file_ext = os.path.splitext(file.filename)[1]
-                    # CHANGED: Removed user_id subfolder.
-                    file_name = f"repair_{uuid.uuid4()}{file_ext}"
-                    file.seek(0)
-                    supabase.storage.from_('pdfs').upload(file_name, file.read())
-                    res_url = supabase.storage.from_('pdfs').get_public_url(file_name)
-                    url = res_url if isinstance(res_url, str) else res_url.public_url
-                    file_urls_text += f"\n\n[Attached File: {url}]"
-
-        final_description = description + file_urls_text
-
+        repair_id = new_id()
         repair_entry = {
+            "id": repair_id,
             "reported_by_id": user_id,
             "terminal_id": terminal_id, 
             "subject": subject,
-            "description": final_description,
+            "description": description,
             "status": "pending",        
-            "priority": "medium",
-            "reported_at": datetime.now().isoformat()
+            "priority": priority,
+            "reported_at": datetime.now(timezone.utc).isoformat()
         }
-        
-        supabase.table('repairs').insert(repair_entry).execute()
+
+        # Attachments are rows pointing at the repair (queued after it, in
+        # the same transaction; uploads are spooled if storage is unreachable)
+        blob_rows, attachment_entries, ref_rows = [], [], []
+        for file in files:
+            if file.filename:
+                blob = stage_blob(supabase, file)
+                blob_rows.extend(blob['outbox_rows'])
+                ref_rows.append(blob_ref_row(blob['sha256'], f"repair:{repair_id}"))
+                attachment_entries.append({
+                    "repair_id": repair_id,
+                    "file_url": public_url(supabase, blob['path']),
+                    "file_type": file.mimetype
+                })
+        enqueue_rows([('repairs', repair_entry)] + blob_rows
+                     + [('attachments', entry) for entry in attachment_entries] + ref_rows)
 
         flash("Repair report submitted successfully!", "success")
         return redirect(url_for('employee_bp.employee_dashboard'))
 
     except Exception as e:
         flash(f"Error submitting repair report: {e}", "error")
-        return redirect(url_for('employee_bp.employee_dashboard'))
\ No newline at end of file
+        return redirect(url_for('employee_bp.employee_dashboard'))
+
+# ---------------------------------------------------------------------------------------------------
+## Repair work queue API
+# ---------------------------------------------------------------------------------------------------
+# Pending repairs are read per terminal in (priority_rank, reported_at) order,
+# which is served by the partial index in sql/007_repair_queue.sql. Claims and
+# completions are conditional updates on the row's version: if someone else
+# got there first, the update matches no rows and nothing is overwritten.
+
+QUEUE_COLUMNS = 'id, terminal_id, subject, description, priority, status, reported_at, version, ' \
+                'claimed_by, claimed_at, attachments(file_url, file_type)'
+CLAIM_CANDIDATES = 5  # head-of-queue rows tried per read of the queue
+CLAIM_ROUNDS = 3      # fresh reads before a contended claim gives up with 409
+
+
+def _queue_terminal():
+    terminal_id = request.values.get('terminal_id') or session.get('terminal_id')
+    if not terminal_id:
+        return None, (jsonify({'error': "'terminal_id' is required"}), 400)
+    return terminal_id, None
+
+
+def _pending_repairs(terminal_id, limit):
+    return resilient_call(
+        lambda: supabase.table('repairs').select(QUEUE_COLUMNS)
+            .eq('terminal_id', terminal_id).eq('status', 'pending')
+            .order('priority_rank').order('reported_at').limit(limit).execute(),
+        retries=1
+    ).data or []
+
+
+@employee_bp.route('/repairs/queue')
+@login_required(role='employee')
+def repair_queue():
+    terminal_id, error = _queue_terminal()
+    if error:
+        return error
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+
+    try:
+        repairs = _pending_repairs(terminal_id, limit)
+    except Exception as e:
+        return jsonify({'error': f"Error loading repair queue: {e}"}), 503
+
+    return jsonify({'terminal_id': terminal_id, 'repairs': repairs})
+
+
+@employee_bp.route('/repairs/claim_next', methods=['POST'])
+@login_required(role='employee')
+def claim_next_repair():
+    terminal_id, error = _queue_terminal()
+    if error:
+        return error
+
+    try:
+        for _ in range(CLAIM_ROUNDS):
+            candidates = _pending_repairs(terminal_id, CLAIM_CANDIDATES)
+            if not candidates:
+                return jsonify({'error': 'No pending repairs for this terminal'}), 404
+            for candidate in candidates:
+                claimed = supabase.table('repairs').update({
+                    'status': 'in_progress',
+                    'claimed_by': session.get('user_id'),
+                    'claimed_at': datetime.now(timezone.utc).isoformat(),
+                    'version': candidate['version'] + 1
+                }).eq('id', candidate['id']).eq('version', candidate['version']) \
+                    .eq('status', 'pending').execute()
+                if claimed.data:
+                    repair = claimed.data[0]
+                    repair['attachments'] = candidate.get('attachments', [])
+                    return jsonify({'repair': repair})
+            # Every candidate went to someone else: read the queue again
+    except Exception as e:
+        return jsonify({'error': f"Error claiming repair: {e}"}), 503
+
+    return jsonify({'error': 'Other claims kept winning the pending repairs, please try again'}), 409
+
+
+@employee_bp.route('/repairs/<repair_id>/complete', methods=['POST'])
+@login_required(role='employee')
+def complete_repair(repair_id):
+    version = request.values.get('version', type=int)
+    if version is None:
+        return jsonify({'error': "'version' is required"}), 400
+
+    try:
+        completed = supabase.table('repairs').update({
+            'status': 'completed',
+            'completed_at': datetime.now(timezone.utc).isoformat(),
+            'version': version + 1
+        }).eq('id', repair_id).eq('version', version) \
+            .eq('status', 'in_progress').eq('claimed_by', session.get('user_id')).execute()
+    except Exception as e:
+        return jsonify({'error': f"Error completing repair: {e}"}), 503
+
+    if not completed.data:
+        return jsonify({'error': 'Repair was changed by someone else or is not claimed by you'}), 409
+    return jsonify({'repair': completed.data[0]})
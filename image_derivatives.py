@@ -0,0 +1,86 @@
+import hashlib
+import io
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it we just serve originals
+    Image = None
+
+# --- Derivative settings ---
+# Each variant is (max edge in px, JPEG quality). 'thumb' is used in the
+# attachment galleries, 'web' is what the gallery links open.
+VARIANTS = {
+    'thumb': (320, 70),
+    'web': (1280, 80),
+}
+BUCKET = 'pdfs'
+DERIVATIVE_DIR = 'blobs'  # stored next to the blob they were made from
+
+# content hash -> {'thumbnail_url': ..., 'web_url': ...}
+_derivative_cache = {}
+
+
+def derivative_path(content_hash, variant):
+    return f"{DERIVATIVE_DIR}/{content_hash}_{variant}.jpg"
+
+
+def _public_url(supabase, path):
+    res_url = supabase.storage.from_(BUCKET).get_public_url(path)
+    return res_url if isinstance(res_url, str) else res_url.public_url
+
+
+def _render_variant(image, max_edge, quality):
+    copy = image.copy()
+    copy.thumbnail((max_edge, max_edge))
+    out = io.BytesIO()
+    copy.save(out, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def _already_stored(supabase, content_hash):
+    """Checks the bucket for derivatives generated by an earlier request/worker."""
+    try:
+        listing = supabase.storage.from_(BUCKET).list(DERIVATIVE_DIR, {'search': content_hash})
+    except Exception:
+        return False
+    names = {item.get('name') for item in listing or []}
+    return all(f"{content_hash}_{variant}.jpg" in names for variant in VARIANTS)
+
+
+def create_derivatives(supabase, data, content_type, content_hash=None, fresh=False):
+    """
+    Generates a thumbnail and a web-optimised copy of an uploaded image.
+    Derivatives are keyed by the SHA-256 of the original, so the same photo
+    is only ever processed once. Pass fresh=True when the original was just
+    uploaded: any earlier derivatives may have been swept with it. Returns a
+    dict with 'thumbnail_url' and 'web_url', or an empty dict for non-images
+    or if processing fails.
+    """
+    if Image is None or not content_type or not content_type.startswith('image/'):
+        return {}
+
+    content_hash = content_hash or hashlib.sha256(data).hexdigest()
+    if content_hash in _derivative_cache and not fresh:
+        return _derivative_cache[content_hash]
+
+    urls = {
+        'thumbnail_url': _public_url(supabase, derivative_path(content_hash, 'thumb')),
+        'web_url': _public_url(supabase, derivative_path(content_hash, 'web')),
+    }
+
+    if fresh or not _already_stored(supabase, content_hash):
+        try:
+            image = Image.open(io.BytesIO(data))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            for variant, (max_edge, quality) in VARIANTS.items():
+                supabase.storage.from_(BUCKET).upload(
+                    derivative_path(content_hash, variant),
+                    _render_variant(image, max_edge, quality),
+                    {"content-type": "image/jpeg", "cache-control": "31536000", "upsert": "true"}
+                )
+        except Exception as e:
+            print(f"Error creating image derivatives: {e}")
+            return {}
+
+    _derivative_cache[content_hash] = urls
+    return urls
@@ -0,0 +1,181 @@
+from flask import Blueprint, request, jsonify
+from supabase import create_client, Client
+import threading
+import time
+import os
+
+from resilience import client_options, resilient_call
+
+journey_bp = Blueprint('journey_bp', __name__)
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=client_options())
+
+# How long the routes cache (and the paths precomputed from it) stays valid
+ROUTES_CACHE_TTL = int(os.getenv('ROUTES_CACHE_TTL', 300))
+# After a failed refresh, keep the old graph and try again this much later
+ROUTES_RETRY_AFTER = 15
+
+CHEAPEST = 'cheapest'
+FEWEST_TRANSFERS = 'fewest_transfers'
+MODES = (CHEAPEST, FEWEST_TRANSFERS)
+
+INF = float('inf')
+
+
+class RouteGraph:
+    """
+    Terminals as nodes, routes as directed edges weighted by base_price.
+    All-pairs paths are precomputed when the graph is built, so plan()
+    is a single dict lookup.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.terminal_ids = sorted({str(r['origin_terminal_id']) for r in routes} |
+                                   {str(r['destination_terminal_id']) for r in routes})
+        self.index = {t: i for i, t in enumerate(self.terminal_ids)}
+
+        # Cheapest direct route for each ordered terminal pair
+        self.direct = {}
+        for r in routes:
+            key = (str(r['origin_terminal_id']), str(r['destination_terminal_id']))
+            if key[0] == key[1]:
+                continue
+            if key not in self.direct or _price(r) < _price(self.direct[key]):
+                self.direct[key] = r
+
+        # mode -> {(from_id, to_id): (legs, total_price)}
+        self.paths = {
+            CHEAPEST: self._all_pairs(lambda price: (price, 1)),
+            FEWEST_TRANSFERS: self._all_pairs(lambda price: (1, price)),
+        }
+
+    def _all_pairs(self, edge_weight):
+        """
+        Floyd-Warshall over (primary, secondary) weight tuples, so ties on the
+        primary metric are broken by the other one (fewer legs for cheapest,
+        lower price for fewest transfers).
+        """
+        n = len(self.terminal_ids)
+        dist = [[(INF, INF)] * n for _ in range(n)]
+        next_hop = [[None] * n for _ in range(n)]
+        for (origin, destination), r in self.direct.items():
+            i, j = self.index[origin], self.index[destination]
+            dist[i][j] = edge_weight(_price(r))
+            next_hop[i][j] = j
+
+        for k in range(n):
+            dist_k = dist[k]
+            for i in range(n):
+                dist_ik = dist[i][k]
+                if dist_ik[0] == INF:
+                    continue
+                dist_i, next_i = dist[i], next_hop[i]
+                for j in range(n):
+                    dist_kj = dist_k[j]
+                    if dist_kj[0] == INF or i == j:
+                        continue
+                    candidate = (dist_ik[0] + dist_kj[0], dist_ik[1] + dist_kj[1])
+                    if candidate < dist_i[j]:
+                        dist_i[j] = candidate
+                        next_i[j] = next_i[k]
+
+        paths = {}
+        for i in range(n):
+            for j in range(n):
+                if i == j or next_hop[i][j] is None:
+                    continue
+                legs = []
+                current = i
+                while current != j:
+                    hop = next_hop[current][j]
+                    legs.append(self.direct[(self.terminal_ids[current], self.terminal_ids[hop])])
+                    current = hop
+                paths[(self.terminal_ids[i], self.terminal_ids[j])] = (
+                    tuple(legs), sum(_price(r) for r in legs)
+                )
+        return paths
+
+    def direct_route(self, from_id, to_id):
+        return self.direct.get((str(from_id), str(to_id)))
+
+    def plan(self, from_id, to_id, mode=CHEAPEST):
+        """Returns (legs, total_price) or None if the terminals are not connected."""
+        return self.paths[mode].get((str(from_id), str(to_id)))
+
+
+def _price(route):
+    return float(route.get('base_price') or 0)
+
+
+# --- Routes cache ---
+_cache = {'graph': None, 'loaded_at': 0.0}
+_cache_lock = threading.Lock()
+
+
+def get_route_graph():
+    """Returns the cached RouteGraph, rebuilding it when the routes cache expires."""
+    graph = _cache['graph']
+    if graph is not None and time.monotonic() - _cache['loaded_at'] < ROUTES_CACHE_TTL:
+        return graph
+    with _cache_lock:
+        # Another thread may have refreshed it while we waited
+        if _cache['graph'] is None or time.monotonic() - _cache['loaded_at'] >= ROUTES_CACHE_TTL:
+            try:
+                routes = resilient_call(
+                    lambda: supabase.table('routes')
+                        .select('id, name, origin_terminal_id, destination_terminal_id, base_price, duration_minutes').execute(),
+                    retries=2
+                )
+            except Exception as e:
+                if _cache['graph'] is None:
+                    raise
+                # Serve the stale graph while Supabase is unavailable
+                print(f"Error refreshing routes, keeping cached graph: {e}")
+                _cache['loaded_at'] = time.monotonic() - ROUTES_CACHE_TTL + ROUTES_RETRY_AFTER
+                return _cache['graph']
+            _cache['graph'] = RouteGraph(routes.data or [])
+            _cache['loaded_at'] = time.monotonic()
+        return _cache['graph']
+
+
+# ---------------------------------------------------------------------------------------------------
+## Journey API
+# ---------------------------------------------------------------------------------------------------
+
+@journey_bp.route('/api/journey')
+def plan_journey():
+    from_id = request.args.get('from')
+    to_id = request.args.get('to')
+    mode = request.args.get('mode', CHEAPEST)
+
+    if not from_id or not to_id:
+        return jsonify({'error': "'from' and 'to' terminal ids are required"}), 400
+    if mode not in MODES:
+        return jsonify({'error': f"mode must be one of: {', '.join(MODES)}"}), 400
+    if from_id == to_id:
+        return jsonify({'error': "'from' and 'to' terminals cannot be the same"}), 400
+
+    try:
+        result = get_route_graph().plan(from_id, to_id, mode)
+    except Exception as e:
+        return jsonify({'error': f"Error loading routes: {e}"}), 503
+
+    if result is None:
+        return jsonify({'error': 'No journey connects these terminals'}), 404
+
+    legs, total_price = result
+    return jsonify({
+        'mode': mode,
+        'legs': [{
+            'route_id': r['id'],
+            'name': r.get('name'),
+            'origin_terminal_id': r['origin_terminal_id'],
+            'destination_terminal_id': r['destination_terminal_id'],
+            'base_price': r.get('base_price')
+        } for r in legs],
+        'transfers': len(legs) - 1,
+        'total_price': total_price
+    })
@@ -0,0 +1,90 @@
+from flask.json.provider import DefaultJSONProvider
+from datetime import date, datetime, time
+from decimal import Decimal
+import dataclasses
+import os
+import uuid
+
+try:
+    import orjson
+except ImportError:  # falls back to the standard library json module
+    orjson = None
+
+# --- JSON provider for jsonify / app.json ---
+# JSON_PROVIDER=orjson serialises API responses with orjson, which handles
+# datetime and UUID natively and is several times faster than json.dumps on
+# the live-map payload. JSON_PROVIDER=stdlib keeps Flask's json module;
+# 'auto' (the default) uses orjson when it is installed. Both backends write
+# datetimes as ISO 8601 and Decimals as strings, so switching between them
+# does not change what clients receive.
+PROVIDERS = ('auto', 'orjson', 'stdlib')
+
+
+def _default(o):
+    """Types neither backend serialises the same way on its own."""
+    if isinstance(o, (datetime, date, time)):
+        return o.isoformat()
+    if isinstance(o, (Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    """Flask's provider with ISO 8601 datetimes instead of HTTP dates."""
+    default = staticmethod(_default)
+
+
+class OrjsonProvider(StdlibJSONProvider):
+    """
+    Serialises with orjson. Anything orjson rejects (e.g. integers wider
+    than 64 bits) goes through the standard library instead.
+    """
+
+    def _options(self, indent=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps_bytes(self, obj, indent=False):
+        try:
+            return orjson.dumps(obj, default=_default, option=self._options(indent))
+        except TypeError:
+            return super().dumps(obj, indent=2 if indent else None).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if set(kwargs) - {'indent'}:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj, indent=bool(kwargs.get('indent'))).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(
+            self.dumps_bytes(obj, indent=indent) + (b"\n" if indent else b""),
+            mimetype=self.mimetype
+        )
+
+
+def init_json(app):
+    """Installs the JSON provider chosen by app.config['JSON_PROVIDER']."""
+    app.config.setdefault('JSON_PROVIDER', os.getenv('JSON_PROVIDER', 'auto'))
+    choice = app.config['JSON_PROVIDER']
+    if choice not in PROVIDERS:
+        raise ValueError(f"JSON_PROVIDER must be one of: {', '.join(PROVIDERS)}")
+    if choice == 'orjson' and orjson is None:
+        raise RuntimeError("JSON_PROVIDER=orjson but the orjson package is not installed")
+
+    use_orjson = orjson is not None and choice != 'stdlib'
+    app.json = (OrjsonProvider if use_orjson else StdlibJSONProvider)(app)
@@ -0,0 +1,298 @@
+import atexit
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from resilience import resilient_call, is_permanent_error
+
+# --- Durable write-behind outbox ---
+# Submissions are committed to a local SQLite database (WAL mode) and the
+# request returns straight away. A background thread in each worker pushes
+# queued rows to Supabase in order, in batches, as idempotent upserts: every
+# row carries its own primary key, so a batch that is retried after a
+# timeout cannot create duplicates.
+#
+# OUTBOX_PATH must be on a disk that survives restarts (render.yaml mounts
+# one); workers also try to drain the queue when they shut down.
+OUTBOX_PATH = os.getenv('OUTBOX_PATH', 'outbox.db')
+# Uploaded bytes waiting for the flusher (see write_spool / register_handler)
+SPOOL_DIR = os.getenv('OUTBOX_SPOOL_DIR', os.path.join(os.path.dirname(OUTBOX_PATH) or '.', 'outbox_spool'))
+BATCH_SIZE = 50
+FLUSH_INTERVAL = 1.0          # seconds between polls when the queue is empty
+BASE_BACKOFF = 2.0            # seconds; doubled per failed attempt
+MAX_BACKOFF = 300.0
+MAX_ATTEMPTS = 20             # after this a row is parked for inspection
+# Rows Supabase rejects outright (constraint violations, bad columns) are
+# parked at once and skipped, so they do not hold up the queue behind them.
+# `flask outbox-parked` lists parked rows and `flask outbox-replay` requeues them.
+LEASE_SECONDS = 60            # how long one flusher owns a claimed batch
+HANDLER_TIMEOUT = 60.0        # seconds; handlers upload files, not rows
+DRAIN_ON_EXIT_SECONDS = float(os.getenv('OUTBOX_DRAIN_SECONDS', 20))
+
+_local = threading.local()
+_wakeup = threading.Event()
+_flusher = {'thread': None}
+_flusher_lock = threading.Lock()
+# pseudo table name -> fn(supabase, payloads) that delivers rows itself
+_handlers = {}
+
+
+def _connect():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(OUTBOX_PATH, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")  # a queued report must survive a crash
+        conn.execute("""
+            create table if not exists outbox (
+                seq integer primary key autoincrement,
+                table_name text not null,
+                on_conflict text not null,
+                payload text not null,
+                attempts integer not null default 0,
+                next_attempt_at real not null default 0,
+                leased_until real not null default 0,
+                dead integer not null default 0,
+                last_error text,
+                created_at real not null
+            )
+        """)
+        conn.execute("create index if not exists outbox_pending_idx on outbox (dead, seq)")
+        _local.conn = conn
+    return conn
+
+
+def enqueue_rows(rows):
+    """
+    Durably queues [(table_name, row), ...] in one transaction, in order.
+    Rows without an 'id' get a new UUID. Returns the row ids.
+    """
+    conn = _connect()
+    now = time.time()
+    ids = []
+    conn.execute("begin immediate")
+    try:
+        for entry in rows:
+            table_name, row = entry[0], entry[1]
+            on_conflict = entry[2] if len(entry) > 2 else 'id'
+            if on_conflict == 'id':
+                row.setdefault('id', str(uuid.uuid4()))
+            ids.append(row.get('id'))
+            conn.execute(
+                "insert into outbox (table_name, on_conflict, payload, created_at) values (?, ?, ?, ?)",
+                (table_name, on_conflict, json.dumps(row, default=str), now)
+            )
+        conn.execute("commit")
+    except Exception:
+        conn.execute("rollback")
+        raise
+    _wakeup.set()
+    return ids
+
+
+def enqueue(table_name, row, on_conflict='id'):
+    """Durably queues one row for insertion. Returns its id."""
+    return enqueue_rows([(table_name, row, on_conflict)])[0]
+
+
+def new_id():
+    """An id for a row that other rows in the same enqueue_rows() call refer to."""
+    return str(uuid.uuid4())
+
+
+def register_handler(table_name, handler):
+    """
+    Queued rows for `table_name` are passed to handler(supabase, payloads)
+    instead of being upserted, e.g. file uploads that must reach storage
+    before the rows queued after them. The handler must be idempotent.
+    """
+    _handlers[table_name] = handler
+
+
+def write_spool(name, data):
+    """Durably saves bytes for a queued handler row to pick up later."""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    path = os.path.join(SPOOL_DIR, name)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_spool(name):
+    try:
+        with open(os.path.join(SPOOL_DIR, name), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def remove_spool(name):
+    try:
+        os.remove(os.path.join(SPOOL_DIR, name))
+    except FileNotFoundError:
+        pass
+
+
+def _claim_batch(conn):
+    """
+    Leases the oldest queued rows. Rows are strictly FIFO so attachments never
+    reach Supabase before the feedback they belong to; if the head of the
+    queue is backing off or leased by another worker, nothing is claimed.
+    """
+    now = time.time()
+    conn.execute("begin immediate")
+    try:
+        rows = conn.execute(
+            "select seq, table_name, on_conflict, payload, attempts, next_attempt_at, leased_until "
+            "from outbox where dead = 0 order by seq limit ?", (BATCH_SIZE,)
+        ).fetchall()
+        if not rows or rows[0][5] > now or rows[0][6] > now:
+            conn.execute("commit")
+            return []
+        batch = [r for r in rows if r[6] <= now]
+        conn.execute(
+            f"update outbox set leased_until = ? where seq in ({','.join('?' * len(batch))})",
+            [now + LEASE_SECONDS] + [r[0] for r in batch]
+        )
+        conn.execute("commit")
+        return batch
+    except Exception:
+        conn.execute("rollback")
+        raise
+
+
+def _backoff(attempts):
+    delay = min(MAX_BACKOFF, BASE_BACKOFF * (2 ** (attempts - 1)))
+    return delay * random.uniform(0.5, 1.5)
+
+
+def flush_once(supabase):
+    """Pushes one batch to Supabase. Returns the number of rows delivered."""
+    conn = _connect()
+    batch = _claim_batch(conn)
+    delivered = 0
+
+    # Consecutive rows for the same table go up as one bulk upsert
+    groups = []
+    for row in batch:
+        if groups and groups[-1][0] == (row[1], row[2]):
+            groups[-1][1].append(row)
+        else:
+            groups.append(((row[1], row[2]), [row]))
+
+    index = 0
+    while index < len(groups):
+        (table_name, on_conflict), rows = groups[index]
+        try:
+            payload = [json.loads(r[3]) for r in rows]
+            # No retries here: the outbox's own backoff handles that
+            if table_name in _handlers:
+                resilient_call(lambda: _handlers[table_name](supabase, payload),
+                               upstream='storage', timeout=HANDLER_TIMEOUT)
+            else:
+                resilient_call(
+                    lambda: supabase.table(table_name).upsert(
+                        payload, on_conflict=on_conflict, ignore_duplicates=True
+                    ).execute(),
+                    timeout=15
+                )
+        except Exception as e:
+            if is_permanent_error(e) and len(rows) > 1:
+                # Some row in the group is bad: resend them one at a time so only it is parked
+                groups[index:index + 1] = [((table_name, on_conflict), [r]) for r in rows]
+                continue
+            if is_permanent_error(e):
+                conn.execute(
+                    "update outbox set dead = 1, leased_until = 0, attempts = attempts + 1, last_error = ? "
+                    "where seq = ?", (str(e)[:500], rows[0][0])
+                )
+                print(f"Outbox row {rows[0][0]} rejected by '{table_name}', parked: {e}")
+                index += 1
+                continue
+            # Keep ordering: this group and everything after it wait together
+            remaining = [r for _, group in groups[index:] for r in group]
+            attempts = rows[0][4] + 1
+            conn.execute(
+                f"update outbox set leased_until = 0 where seq in ({','.join('?' * len(remaining))})",
+                [r[0] for r in remaining]
+            )
+            conn.execute(
+                f"update outbox set attempts = attempts + 1, next_attempt_at = ?, last_error = ?, "
+                f"dead = case when attempts + 1 >= ? then 1 else 0 end "
+                f"where seq in ({','.join('?' * len(rows))})",
+                [time.time() + _backoff(attempts), str(e)[:500], MAX_ATTEMPTS] + [r[0] for r in rows]
+            )
+            print(f"Outbox flush to '{table_name}' failed (attempt {attempts}): {e}")
+            break
+        conn.execute(f"delete from outbox where seq in ({','.join('?' * len(rows))})", [r[0] for r in rows])
+        delivered += len(rows)
+        index += 1
+
+    return delivered
+
+
+def pending_count():
+    return _connect().execute("select count(*) from outbox where dead = 0").fetchone()[0]
+
+
+def parked_rows():
+    """Rows that were rejected or ran out of attempts, oldest first."""
+    return _connect().execute(
+        "select seq, table_name, attempts, last_error, created_at, payload from outbox where dead = 1 order by seq"
+    ).fetchall()
+
+
+def replay_parked(seqs=None):
+    """Requeues parked rows (all of them, or just `seqs`). Returns how many."""
+    query = "update outbox set dead = 0, attempts = 0, next_attempt_at = 0, leased_until = 0 where dead = 1"
+    params = []
+    if seqs:
+        query += f" and seq in ({','.join('?' * len(seqs))})"
+        params = list(seqs)
+    count = _connect().execute(query, params).rowcount
+    _wakeup.set()
+    return count
+
+
+def _flush_forever(supabase):
+    while True:
+        try:
+            if flush_once(supabase):
+                continue  # more may be waiting
+        except Exception as e:
+            print(f"Error flushing outbox: {e}")
+        _wakeup.wait(FLUSH_INTERVAL)
+        _wakeup.clear()
+
+
+def drain(supabase, seconds=DRAIN_ON_EXIT_SECONDS):
+    """Flushes until the queue is empty, stuck, or `seconds` have passed."""
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            if not flush_once(supabase):
+                break
+        except Exception as e:
+            print(f"Error draining outbox: {e}")
+            break
+    return pending_count()
+
+
+def start_flusher(supabase):
+    """Starts this worker's background flusher thread (once)."""
+    with _flusher_lock:
+        if _flusher['thread'] is None:
+            _flusher['thread'] = threading.Thread(
+                target=_flush_forever, args=(supabase,), name='outbox-flusher', daemon=True
+            )
+            _flusher['thread'].start()
+            # Deliver what we can before this worker goes away (redeploys, scaling down)
+            atexit.register(drain, supabase)
@@ -0,0 +1,133 @@
+from functools import wraps
+from collections import OrderedDict
+from flask import request, session, current_app, make_response, Response
+import hashlib
+import json
+import threading
+import time
+import os
+
+from redis_client import get_redis
+
+# --- Full-page cache for anonymous visitors ---
+# Pages rendered for someone with no session cookie are identical for
+# everyone, so they are rendered once per TTL and served from memory (and
+# from Redis, shared between workers, when REDIS_URL is set). Anything with a
+# session cookie - logged-in users, pending flash messages - bypasses it.
+PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 60))
+PAGE_CACHE_SIZE = int(os.getenv('PAGE_CACHE_SIZE', 128))
+
+
+class LRUCache:
+    """A small thread-safe LRU with per-entry expiry."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_local_cache = LRUCache(PAGE_CACHE_SIZE)
+
+
+def _shared_get(key):
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        raw = client.get(f"page:{key}")
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        print(f"Error reading shared page cache: {e}")
+        return None
+
+
+def _shared_set(key, entry, ttl):
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.set(f"page:{key}", json.dumps(entry), ex=ttl)
+    except Exception as e:
+        print(f"Error writing shared page cache: {e}")
+
+
+def _is_anonymous():
+    return current_app.config['SESSION_COOKIE_NAME'] not in request.cookies
+
+
+def _respond(entry):
+    if entry['etag'] in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(entry['body'], mimetype=entry['mimetype'])
+    response.set_etag(entry['etag'])
+    # Browsers must revalidate, so a login in another tab is never masked
+    response.headers['Cache-Control'] = 'public, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def cache_anonymous_page(ttl=PAGE_CACHE_TTL):
+    """
+    Caches a GET view's rendered page for anonymous visitors, with ETag /
+    If-None-Match support. Only 200 responses that did not touch the
+    session are stored.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET' or not _is_anonymous():
+                return f(*args, **kwargs)
+
+            key = request.full_path
+            entry = _local_cache.get(key)
+            if entry is None:
+                entry = _shared_get(key)
+                if entry is not None:
+                    _local_cache.set(key, entry, ttl)
+            if entry is not None:
+                return _respond(entry)
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough or session.modified or session:
+                return response
+
+            body = response.get_data(as_text=True)
+            entry = {
+                'body': body,
+                'mimetype': response.mimetype,
+                'etag': hashlib.sha256(body.encode('utf-8')).hexdigest()[:32]
+            }
+            _local_cache.set(key, entry, ttl)
+            _shared_set(key, entry, ttl)
+            return _respond(entry)
+        return decorated_function
+    return decorator
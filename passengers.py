@@ -1,28 +1,30 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from supabase import create_client, Client
-from datetime import datetime
-import uuid
+from datetime import datetime, timezone
 import os
 
 # Import the shared decorator
 from decorators import login_required
+from resilience import client_options, resilient_call
+from image_derivatives import create_derivatives
+from blob_store import stage_blob, blob_ref_row, public_url
+from journey_planner import get_route_graph, FEWEST_TRANSFERS
+from timetable import get_timetable, current_minute
+from rate_limit import rate_limited
+from outbox import enqueue_rows, new_id
+from demand import record_preference_change
 
 passenger_bp = Blueprint('passenger_bp', __name__)
 
 # Re-create the Supabase client for this blueprint
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=client_options())
 
-# --- Helper function to generate 30-min time slots ---
+# --- Helper function for the time slot dropdown ---
 def get_time_slots():
-    """Generates time slots from 08:00 to 20:00 in 30-min intervals."""
-    slots = []
-    for hour in range(8, 21): # 8 AM to 8 PM (20:xx)
-        slots.append(f"{hour:02d}:00")
-        if hour != 20: # Don't add 20:30
-            slots.append(f"{hour:02d}:30")
-    return slots
+    """Every departure time in the timetable, e.g. ['08:00', '08:30', ...]."""
+    return get_timetable().slots
 # -----------------------------------------------------------
 
 @passenger_bp.route('/dashboard')
@@ -38,21 +40,34 @@ def passenger_dashboard():
     
     try:
         # --- MODIFIED: Fetch route name AND base_price ---
-        pref_response = supabase.table('passenger_preferences').select('id, preferred_time, routes(name, base_price)') \
+        pref_response = supabase.table('passenger_preferences').select('id, route_id, preferred_time, routes(name, base_price)') \
             .eq('passenger_id', user_id).order('preferred_time').execute()
         if pref_response.data:
             preferences = pref_response.data
+
+        # Next boat on each preferred route
+        timetable = get_timetable()
+        now_minute = current_minute()
+        for pref in preferences:
+            pref['next_departure'] = timetable.next_route_departure(pref['route_id'], now_minute)
             
-        # Fetch all terminals for the dropdowns
-        term_response = supabase.table('terminals').select('*').order('name').execute()
+        # Fetch all terminals for the dropdowns (reference data: stale is fine if Supabase is down)
+        term_response = resilient_call(
+            lambda: supabase.table('terminals').select('*').order('name').execute(),
+            retries=1, stale_key='terminals'
+        )
         if term_response.data:
             terminals = term_response.data
 
     except Exception as e:
         flash(f"Error loading dashboard data: {e}", "error")
 
-    # Get the 30-minute time slots for the dropdown
-    time_slots = get_time_slots()
+    # Get the timetable's departure times for the dropdown
+    try:
+        time_slots = get_time_slots()
+    except Exception as e:
+        flash(f"Error loading timetable: {e}", "error")
+        time_slots = []
 
     return render_template(
         'passenger_dashboard.html',
@@ -81,6 +96,8 @@ def save_preferences():
 
         # Batch insert the new preferences
         new_prefs_data = []
+        route_graph = get_route_graph()
+        timetable = get_timetable()
         
         for from_id, to_id, time_str in zip(from_terminal_ids, to_terminal_ids, preferred_times):
             if not from_id or not to_id or not time_str:
@@ -90,37 +107,46 @@ def save_preferences():
                 flash(f"'From' and 'To' terminals cannot be the same. Skipping row.", "error")
                 continue
 
-            # Find the route that matches this from/to pair
-            route_response = supabase.table('routes').select('id') \
-                .eq('origin_terminal_id', from_id) \
-                .eq('destination_terminal_id', to_id) \
-                .limit(1).execute()
-
-            if route_response.data:
-                route_id = route_response.data[0]['id']
-                
-                # --- NEW: Check if this preference already exists ---
-                existing_pref = supabase.table('passenger_preferences') \
-                    .select('id') \
-                    .eq('passenger_id', user_id) \
-                    .eq('route_id', route_id) \
-                    .eq('preferred_time', time_str) \
-                    .limit(1).execute()
-                
-                if not existing_pref.data:
-                    new_prefs_data.append({
-                        'passenger_id': user_id,
-                        'route_id': route_id,
-                        'preferred_time': time_str
-                    })
-                else:
-                    flash(f"Preference already exists and was skipped.", "info")
+            # Direct route if there is one, otherwise the trip with the fewest transfers.
+            # Each leg is saved as its own preference, at the boat it actually connects to.
+            journey = route_graph.plan(from_id, to_id, FEWEST_TRANSFERS)
+
+            if journey:
+                legs, _ = journey
+                leg_times = timetable.connecting_departures(legs, time_str)
+                if leg_times is None:
+                    flash(f"No connecting boats after {time_str} for one of your selections. Skipping.", "error")
+                    continue
+                if len(legs) > 1:
+                    flash(f"No direct route for one of your selections; saved it as {len(legs)} legs with {len(legs) - 1} transfer(s).", "info")
+
+                for leg, leg_time in zip(legs, leg_times):
+                    route_id = leg['id']
+                    
+                    # --- NEW: Check if this preference already exists ---
+                    existing_pref = supabase.table('passenger_preferences') \
+                        .select('id') \
+                        .eq('passenger_id', user_id) \
+                        .eq('route_id', route_id) \
+                        .eq('preferred_time', leg_time) \
+                        .limit(1).execute()
+                    
+                    if not existing_pref.data:
+                        new_prefs_data.append({
+                            'passenger_id': user_id,
+                            'route_id': route_id,
+                            'preferred_time': leg_time
+                        })
+                    else:
+                        flash(f"Preference already exists and was skipped.", "info")
             else:
                 flash(f"Could not find a valid route for one of your selections. Skipping.", "error")
 
         # Insert all new preferences in one go
         if new_prefs_data:
             supabase.table('passenger_preferences').insert(new_prefs_data).execute()
+            for pref in new_prefs_data:
+                record_preference_change(pref['route_id'], pref['preferred_time'], +1)
 
         flash("New preferences saved successfully!", "success")
 
@@ -145,6 +171,8 @@ def delete_preference(preference_id):
             .execute()
         
         if response.data:
+            for pref in response.data:
+                record_preference_change(pref['route_id'], pref['preferred_time'], -1)
             flash("Preference removed successfully.", "success")
         else:
             flash("Could not find preference to remove.", "error")
@@ -160,6 +188,7 @@ def delete_preference(preference_id):
 
 @passenger_bp.route('/feedback', methods=['GET', 'POST'])
 @login_required(role='passenger')
+@rate_limited('give_feedback')
 def give_feedback():
     if request.method == 'POST':
         try:
@@ -172,38 +201,38 @@ def give_feedback():
                 flash("Message is required.", "error")
                 return redirect(url_for('passenger_bp.give_feedback'))
 
-            # 1. Insert feedback text
+            feedback_id = new_id()
             feedback_entry = {
+                "id": feedback_id,
                 "passenger_id": user_id,
                 "subject": subject,
-                "message": message
+                "message": message,
+                "submitted_at": datetime.now(timezone.utc).isoformat()
             }
-            feedback_res = supabase.table('feedbacks').insert(feedback_entry).execute()
-            feedback_id = feedback_res.data[0]['id']
-
-            # 2. Handle file uploads
-            if files and feedback_id:
-                attachment_entries = []
-                for file in files:
-                    if file.filename:
-                        # Create a unique file path
-                        file_ext = os.path.splitext(file.filename)[1]
-                        file_name = f"{user_id}/{feedback_id}_{uuid.uuid4()}{file_ext}"
-                        content_type = file.mimetype
-                        supabase.storage.from_('pdfs').upload(file_name, file.read(),{"content-type": content_type})
-                        
-                        # Get public URL
-                        public_url = supabase.storage.from_('pdfs').get_public_url(file_name)
-                        
-                        attachment_entries.append({
-                            "feedback_id": feedback_id,
-                            "file_url": public_url,
-                            "file_type": file.mimetype
-                        })
 
-                # 3. Insert attachment records
-                if attachment_entries:
-                    supabase.table('attachments').insert(attachment_entries).execute()
+            # 1. Store uploads (spooled locally if storage is unreachable)
+            blob_rows, attachment_entries, ref_rows = [], [], []
+            for file in files:
+                if file.filename:
+                    # Content-addressed: identical files are only uploaded once
+                    blob = stage_blob(supabase, file)
+                    blob_rows.extend(blob['outbox_rows'])
+                    ref_rows.append(blob_ref_row(blob['sha256'], f"feedback:{feedback_id}"))
+                    attachment_entry = {
+                        "feedback_id": feedback_id,
+                        "file_url": public_url(supabase, blob['path']),
+                        "file_type": file.mimetype
+                    }
+                    # Thumbnail + web-sized copies for image attachments
+                    if not blob['spooled']:
+                        attachment_entry.update(create_derivatives(supabase, blob['data'], blob['content_type'], blob['sha256'],
+                                                                   fresh=blob['uploaded']))
+                    attachment_entries.append(attachment_entry)
+
+            # 2. Queue everything in one transaction, parents first (written
+            # to Supabase by the outbox flusher)
+            enqueue_rows([('feedbacks', feedback_entry)] + blob_rows
+                         + [('attachments', entry) for entry in attachment_entries] + ref_rows)
 
             flash("Feedback submitted successfully!", "success")
             return redirect(url_for('passenger_bp.previous_feedbacks'))
@@ -236,6 +265,7 @@ def previous_feedbacks():
 
 @passenger_bp.route('/complaint', methods=['GET', 'POST'])
 @login_required(role='passenger')
+@rate_limited('give_complaint')
 def give_complaint():
     if request.method == 'POST':
         try:
@@ -248,36 +278,39 @@ def give_complaint():
                 flash("Complaint message is required.", "error")
                 return redirect(url_for('passenger_bp.give_complaint'))
 
-            # 1. Insert complaint text
+            complaint_id = new_id()
             complaint_entry = {
+                "id": complaint_id,
                 "passenger_id": user_id,
                 "subject": subject,
                 "message": message,
-                "status": "pending"
+                "status": "pending",
+                "submitted_at": datetime.now(timezone.utc).isoformat()
             }
-            complaint_res = supabase.table('complaints').insert(complaint_entry).execute()
-            complaint_id = complaint_res.data[0]['id']
-
-            # 2. Handle file uploads
-            if files and complaint_id:
-                attachment_entries = []
-                for file in files:
-                    if file.filename:
-                        file_ext = os.path.splitext(file.filename)[1]
-                        file_name = f"{user_id}/complaint_{complaint_id}_{uuid.uuid4()}{file_ext}"
-                        contentt_type = file.mimetype
-                        supabase.storage.from_('pdfs').upload(file_name, file.read(),{"content-type": contentt_type})
-                        public_url = supabase.storage.from_('pdfs').get_public_url(file_name)
-                        
-                        attachment_entries.append({
-                            "complaint_id": complaint_id,
-                            "file_url": public_url,
-                            "file_type": file.mimetype
-                        })
 
-                # 3. Insert attachment records
-                if attachment_entries:
-                    supabase.table('attachments').insert(attachment_entries).execute()
+            # 1. Store uploads (spooled locally if storage is unreachable)
+            blob_rows, attachment_entries, ref_rows = [], [], []
+            for file in files:
+                if file.filename:
+                    # Content-addressed: identical files are only uploaded once
+                    blob = stage_blob(supabase, file)
+                    blob_rows.extend(blob['outbox_rows'])
+                    ref_rows.append(blob_ref_row(blob['sha256'], f"complaint:{complaint_id}"))
+                    attachment_entry = {
+                        "complaint_id": complaint_id,
+                        "file_url": public_url(supabase, blob['path']),
+                        "file_type": file.mimetype
+                    }
+                    # Thumbnail + web-sized copies for image attachments
+                    if not blob['spooled']:
+                        attachment_entry.update(create_derivatives(supabase, blob['data'], blob['content_type'], blob['sha256'],
+                                                                   fresh=blob['uploaded']))
+                    attachment_entries.append(attachment_entry)
+
+            # 2. Queue everything in one transaction, parents first (written
+            # to Supabase by the outbox flusher)
+            enqueue_rows([('complaints', complaint_entry)] + blob_rows
+                         + [('attachments', entry) for entry in attachment_entries] + ref_rows)
 
             flash("Complaint submitted successfully! We will review it shortly.", "success")
             return redirect(url_for('passenger_bp.previous_complaints'))
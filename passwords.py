@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+import threading
+import os
+
+# --- Password hashing service ---
+# All password hashing goes through here. PASSWORD_HASH_ALGORITHM and
+# PASSWORD_WORK_FACTOR choose the werkzeug method (scrypt N, or pbkdf2
+# iterations); hashes made with other parameters still verify and are
+# replaced on the user's next successful login. Hashing runs on a small
+# thread pool - hashlib releases the GIL, so it uses other cores - and at
+# most PASSWORD_HASH_QUEUE hashes may be waiting at once, so a burst of
+# logins is turned away instead of tying up every request thread. Each
+# scrypt hash needs 128 * N * r bytes (32 MiB at the defaults) while it runs,
+# so the pool is kept small: every worker process has its own.
+ALGORITHMS = {
+    'scrypt': lambda work_factor: f"scrypt:{work_factor}:8:1",
+    'pbkdf2': lambda work_factor: f"pbkdf2:sha256:{work_factor}",
+}
+DEFAULT_WORK_FACTORS = {'scrypt': 32768, 'pbkdf2': 1000000}
+
+PASSWORD_HASH_ALGORITHM = os.getenv('PASSWORD_HASH_ALGORITHM', 'scrypt')
+if PASSWORD_HASH_ALGORITHM not in ALGORITHMS:
+    raise ValueError(f"PASSWORD_HASH_ALGORITHM must be one of: {', '.join(ALGORITHMS)}")
+PASSWORD_WORK_FACTOR = int(os.getenv('PASSWORD_WORK_FACTOR', DEFAULT_WORK_FACTORS[PASSWORD_HASH_ALGORITHM]))
+PASSWORD_HASH_METHOD = ALGORITHMS[PASSWORD_HASH_ALGORITHM](PASSWORD_WORK_FACTOR)
+
+PASSWORD_HASH_THREADS = int(os.getenv('PASSWORD_HASH_THREADS', min(2, os.cpu_count() or 1)))
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', 4 * PASSWORD_HASH_THREADS))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_THREADS, thread_name_prefix='password-hash')
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+
+
+class PasswordServiceBusy(Exception):
+    """
+    Raised when too many hashes are already queued, or one waited longer
+    than PASSWORD_HASH_TIMEOUT; the caller should ask the user to retry.
+    """
+
+
+def _submit(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise PasswordServiceBusy("Password service is busy")
+    try:
+        future = _executor.submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeoutError:
+        # Still holds its slot until it finishes, so the pool stays bounded
+        raise PasswordServiceBusy("Password service timed out") from None
+
+
+def needs_rehash(stored_hash):
+    """True if stored_hash was made with a different method or work factor."""
+    return stored_hash.split('$', 1)[0] != PASSWORD_HASH_METHOD
+
+
+def hash_password(password):
+    return _submit(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def _verify(stored_hash, password):
+    if not check_password_hash(stored_hash, password):
+        return False, None
+    # Upgrade in the same job while the plaintext is at hand
+    if needs_rehash(stored_hash):
+        return True, generate_password_hash(password, PASSWORD_HASH_METHOD)
+    return True, None
+
+
+def verify_password(stored_hash, password):
+    """
+    Checks password against stored_hash. Returns (ok, new_hash); new_hash is
+    set when the password matched but the hash should be replaced.
+    """
+    if not stored_hash:
+        return False, None
+    return _submit(_verify, stored_hash, password)
@@ -0,0 +1,245 @@
+from functools import wraps
+from flask import request, session, Response
+import threading
+import time
+import math
+import os
+import uuid
+
+from redis_client import get_redis
+
+# --- Upload limits (per user and per IP, per endpoint) ---
+UPLOAD_RATE_PER_MINUTE = float(os.getenv('UPLOAD_RATE_PER_MINUTE', 10))
+UPLOAD_BURST = int(os.getenv('UPLOAD_BURST', 5))
+UPLOAD_MAX_CONCURRENT = int(os.getenv('UPLOAD_MAX_CONCURRENT', 4))
+UPLOAD_SLOT_TTL = int(os.getenv('UPLOAD_SLOT_TTL', 120))  # seconds before a crashed worker's slot is freed
+
+
+class MemoryBucketStore:
+    """
+    Token buckets kept in this worker's memory. A bucket that has refilled
+    completely is indistinguishable from a missing one, so those are swept
+    out periodically and the dict only holds recently active clients.
+    """
+
+    SWEEP_INTERVAL = 60  # seconds
+
+    def __init__(self):
+        self.buckets = {}  # key -> (tokens, updated, full_at)
+        self.lock = threading.Lock()
+        self.swept_at = time.monotonic()
+
+    def _sweep(self, now):
+        self.swept_at = now
+        for key in [key for key, bucket in self.buckets.items() if bucket[2] <= now]:
+            del self.buckets[key]
+
+    def take(self, keys, rate, capacity):
+        """
+        Takes one token from every bucket in keys, or from none of them if
+        any is empty. Returns (allowed, seconds until a token is available).
+        """
+        now = time.monotonic()
+        with self.lock:
+            if now - self.swept_at >= self.SWEEP_INTERVAL:
+                self._sweep(now)
+            levels = []
+            for key in keys:
+                tokens, updated, _ = self.buckets.get(key, (capacity, now, now))
+                levels.append(min(capacity, tokens + (now - updated) * rate))
+            allowed = all(tokens >= 1 for tokens in levels)
+            for key, tokens in zip(keys, levels):
+                if allowed:
+                    tokens -= 1
+                self.buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if allowed:
+                return True, 0
+            return False, max((1 - tokens) / rate for tokens in levels if tokens < 1)
+
+
+class RedisBucketStore:
+    """Token buckets shared by every worker through Redis."""
+
+    # Refill every bucket, then take from all of them or none, in one atomic step
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local levels = {}
+    local allowed = 1
+    local retry_after = 0
+    for i, key in ipairs(KEYS) do
+        local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or capacity
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+        if tokens < 1 then
+            allowed = 0
+            retry_after = math.max(retry_after, (1 - tokens) / rate)
+        end
+        levels[i] = tokens
+    end
+    for i, key in ipairs(KEYS) do
+        redis.call('HSET', key, 'tokens', levels[i] - allowed, 'updated', now)
+        redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+    end
+    return {allowed, tostring(retry_after)}
+    """
+
+    def __init__(self, client):
+        self.script = client.register_script(self.SCRIPT)
+
+    def take(self, keys, rate, capacity):
+        allowed, retry_after = self.script(keys=[f"ratelimit:{key}" for key in keys],
+                                           args=[rate, capacity, time.time()])
+        return bool(allowed), float(retry_after)
+
+
+_memory_store = MemoryBucketStore()
+_redis_store = None
+
+
+def get_bucket_store():
+    global _redis_store
+    client = get_redis()
+    if client is None:
+        return _memory_store
+    if _redis_store is None:
+        _redis_store = RedisBucketStore(client)
+    return _redis_store
+
+
+def _take(keys, rate, capacity):
+    try:
+        return get_bucket_store().take(keys, rate, capacity)
+    except Exception as e:
+        # Redis trouble should not take the upload routes down with it
+        print(f"Error using shared rate limiter, falling back to memory: {e}")
+        return _memory_store.take(keys, rate, capacity)
+
+
+def too_many_requests(retry_after):
+    return Response(
+        "Too many uploads, please try again shortly.",
+        status=429,
+        mimetype="text/plain",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+class MemorySlotStore:
+    """Concurrency slots for this worker's threads only."""
+
+    def __init__(self):
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, name, limit):
+        with self.lock:
+            if name not in self.semaphores:
+                self.semaphores[name] = threading.BoundedSemaphore(limit)
+            semaphore = self.semaphores[name]
+        return semaphore if semaphore.acquire(blocking=False) else None
+
+    def release(self, name, token):
+        token.release()
+
+
+class RedisSlotStore:
+    """
+    Concurrency slots shared by every worker through Redis. Each slot is a
+    member of a sorted set scored by when it expires, so slots held by a
+    worker that died are reclaimed after UPLOAD_SLOT_TTL seconds.
+    """
+
+    SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local limit = tonumber(ARGV[2])
+    local ttl = tonumber(ARGV[3])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+    if redis.call('ZCARD', KEYS[1]) >= limit then
+        return 0
+    end
+    redis.call('ZADD', KEYS[1], now + ttl, ARGV[4])
+    redis.call('EXPIRE', KEYS[1], ttl)
+    return 1
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.script = client.register_script(self.SCRIPT)
+
+    def acquire(self, name, limit):
+        token = uuid.uuid4().hex
+        acquired = self.script(keys=[f"concurrency:{name}"],
+                               args=[time.time(), limit, UPLOAD_SLOT_TTL, token])
+        return token if acquired else None
+
+    def release(self, name, token):
+        self.client.zrem(f"concurrency:{name}", token)
+
+
+_memory_slots = MemorySlotStore()
+_redis_slots = None
+
+
+def get_slot_store():
+    global _redis_slots
+    client = get_redis()
+    if client is None:
+        return _memory_slots
+    if _redis_slots is None:
+        _redis_slots = RedisSlotStore(client)
+    return _redis_slots
+
+
+def _acquire_slot(name, limit):
+    """Returns (store, token) for a free slot, or (store, None) when all are busy."""
+    store = get_slot_store()
+    try:
+        return store, store.acquire(name, limit)
+    except Exception as e:
+        print(f"Error using shared concurrency limiter, falling back to memory: {e}")
+        return _memory_slots, _memory_slots.acquire(name, limit)
+
+
+def _release_slot(store, name, token):
+    try:
+        store.release(name, token)
+    except Exception as e:
+        print(f"Error releasing concurrency slot: {e}")
+
+
+def rate_limited(name, per_minute=UPLOAD_RATE_PER_MINUTE, burst=UPLOAD_BURST,
+                 max_concurrent=UPLOAD_MAX_CONCURRENT, methods=('POST',)):
+    """
+    Decorator for upload routes: a token bucket per user and per IP, plus a
+    cap on how many requests for this endpoint run at once (across all
+    workers with Redis, per worker otherwise). Over either limit the request
+    gets 429 with Retry-After. Use it below @login_required so the user id
+    is known.
+    """
+    rate = per_minute / 60.0
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in methods:
+                return f(*args, **kwargs)
+
+            # Both buckets are checked before either is charged
+            allowed, retry_after = _take(
+                [f"{name}:user:{session.get('user_id')}", f"{name}:ip:{request.remote_addr}"], rate, burst
+            )
+            if not allowed:
+                return too_many_requests(retry_after)
+
+            store, token = _acquire_slot(name, max_concurrent)
+            if token is None:
+                return too_many_requests(1)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                _release_slot(store, name, token)
+        return decorated_function
+    return decorator
@@ -0,0 +1,19 @@
+import os
+
+try:
+    import redis
+except ImportError:  # Redis is optional; everything falls back to per-process storage
+    redis = None
+
+# Shared by the rate limiter, page cache and session store when REDIS_URL is set
+REDIS_URL = os.getenv('REDIS_URL')
+
+_client = None
+
+
+def get_redis():
+    """Returns the shared Redis connection, or None when Redis is not configured."""
+    global _client
+    if _client is None and REDIS_URL and redis is not None:
+        _client = redis.Redis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _client
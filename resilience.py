@@ -0,0 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+import random
+import threading
+import time
+import os
+
+# --- Resilience layer for Supabase calls ---
+# Wrap a query in resilient_call(lambda: supabase.table(...)...execute(), ...)
+# to get a per-call timeout, jittered retries (reads only), a circuit breaker
+# per upstream, the last good result while the breaker is open, and
+# optionally a hedged duplicate request for latency-critical reads.
+DEFAULT_TIMEOUT = float(os.getenv('SUPABASE_TIMEOUT', 5))
+IO_THREADS = int(os.getenv('SUPABASE_IO_THREADS', 16))
+FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30))
+RETRY_BASE_DELAY = 0.1
+
+_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix='supabase-io')
+
+
+def client_options():
+    """Client-level HTTP timeouts, so calls abandoned by resilient_call still end."""
+    from supabase import ClientOptions
+    return ClientOptions(
+        postgrest_client_timeout=DEFAULT_TIMEOUT * 2,
+        storage_client_timeout=int(os.getenv('SUPABASE_STORAGE_TIMEOUT', 60))
+    )
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after FAILURE_THRESHOLD consecutive failures and rejects calls for
+    RESET_TIMEOUT seconds, then lets a single trial call through (half-open).
+    """
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+# HTTP statuses that are worth retrying even though they are 4xx
+RETRYABLE_STATUSES = (408, 429)
+# SQLSTATE classes for a database that is down, overloaded or cancelling queries
+UPSTREAM_SQLSTATE_CLASSES = ('08', '53', '57')
+
+
+def error_code(error):
+    """
+    The `code` of a postgrest APIError as a string: an HTTP status when the
+    gateway answered with something other than PostgREST JSON, otherwise a
+    SQLSTATE ('23505') or PostgREST code ('PGRST116'). '' for other errors.
+    """
+    if type(error).__name__ != 'APIError':
+        return ''
+    return str(getattr(error, 'code', '') or '')
+
+
+def is_upstream_failure(error):
+    """
+    Timeouts, connection errors and 5xx/408/429 responses count against the
+    breaker and are retried; query errors (4xx, constraint violations) do not.
+    """
+    if isinstance(error, (FutureTimeoutError, ConnectionError, OSError, CircuitOpenError)):
+        return True
+    if type(error).__module__.split('.')[0] in ('httpx', 'httpcore'):
+        return True
+    code = error_code(error)
+    if len(code) == 3 and code.isdigit():  # HTTP status, not a 5-character SQLSTATE
+        return int(code) >= 500 or int(code) in RETRYABLE_STATUSES
+    # PGRST000-003: PostgREST cannot reach the database
+    return code.startswith('PGRST0') or code[:2] in UPSTREAM_SQLSTATE_CLASSES
+
+
+def is_permanent_error(error):
+    """True when Supabase rejected the request itself, so resending it cannot succeed."""
+    return bool(error_code(error)) and not is_upstream_failure(error)
+
+
+# stale_key -> last successful result
+_last_good = {}
+
+
+def _run(fn, timeout, hedge_after):
+    deadline = time.monotonic() + timeout
+    pending = {_executor.submit(fn)}
+    if hedge_after is not None and hedge_after < timeout:
+        done, _ = wait(pending, timeout=hedge_after)
+        if not done:
+            # The first request is slow: race a duplicate against it
+            pending.add(_executor.submit(fn))
+
+    error = None
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    if error is not None and not pending:
+        raise error
+    raise FutureTimeoutError(f"Supabase call timed out after {timeout}s")
+
+
+def resilient_call(fn, upstream='postgrest', timeout=DEFAULT_TIMEOUT, retries=0,
+                   hedge_after=None, stale_key=None):
+    """
+    Runs fn() with a timeout behind the `upstream` circuit breaker.
+    Only pass retries/hedge_after for idempotent reads. With a stale_key,
+    the last good result is returned when the call fails or the circuit
+    is open (use it for reference data such as terminals and routes).
+    """
+    breaker = get_breaker(upstream)
+    error = None
+
+    for attempt in range(retries + 1):
+        if not breaker.allow():
+            error = error or CircuitOpenError(f"Circuit for '{upstream}' is open")
+            break
+        try:
+            result = _run(fn, timeout, hedge_after)
+        except Exception as e:
+            if not is_upstream_failure(e):
+                # Supabase answered, it just rejected this query
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            error = e
+            if attempt < retries:
+                # Full jitter: spread retries so workers don't stampede together
+                time.sleep(random.uniform(0, RETRY_BASE_DELAY * (2 ** attempt)))
+            continue
+        breaker.record_success()
+        if stale_key is not None:
+            _last_good[stale_key] = result
+        return result
+
+    if stale_key is not None and stale_key in _last_good:
+        print(f"Serving stale '{stale_key}' after Supabase error: {error}")
+        return _last_good[stale_key]
+    raise error
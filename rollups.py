@@ -0,0 +1,123 @@
+from flask import Blueprint, request, jsonify
+from supabase import create_client, Client
+from datetime import datetime, timedelta
+import threading
+import time
+import os
+
+from decorators import login_required
+from resilience import client_options, resilient_call
+from timetable import TIMETABLE_TZ
+
+rollups_bp = Blueprint('rollups_bp', __name__)
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=client_options())
+
+# Reads trigger an incremental refresh at most this often (per worker)
+ROLLUP_REFRESH_INTERVAL = int(os.getenv('ROLLUP_REFRESH_INTERVAL', 30))
+MAX_DAYS = 366
+PAGE_SIZE = 1000  # PostgREST's default max rows per request
+
+# name -> (rollup table, dimension column, count column)
+SERIES = {
+    'incidents': ('accident_rollups', 'severity', 'incidents'),
+    'repairs': ('repair_rollups', 'priority', 'repairs'),
+}
+
+_refresh = {'at': 0.0}
+_refresh_lock = threading.Lock()
+
+
+def refresh_rollups():
+    """
+    Folds rows added since the last watermark into the rollup tables
+    (see sql/006_incident_rollups.sql). Returns per-source bucket counts.
+    """
+    res = resilient_call(
+        lambda: supabase.rpc('refresh_rollups', {'tz': TIMETABLE_TZ.key}).execute(),
+        timeout=30
+    )
+    _refresh['at'] = time.monotonic()
+    return res.data or []
+
+
+def _refresh_if_due():
+    if time.monotonic() - _refresh['at'] < ROLLUP_REFRESH_INTERVAL:
+        return
+    # Only one thread per worker refreshes; the others read what is there
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        refresh_rollups()
+    except Exception as e:
+        print(f"Error refreshing rollups: {e}")
+    finally:
+        _refresh_lock.release()
+
+
+def build_time_series(rows, dimension, count_column, start, days):
+    """Turns sparse rollup rows into dense daily series, one per dimension value."""
+    labels = [(start + timedelta(days=d)).isoformat() for d in range(days)]
+    position = {label: d for d, label in enumerate(labels)}
+    series = {}
+    for row in rows:
+        d = position.get(row['day'])
+        if d is None:
+            continue
+        values = series.setdefault(row[dimension], [0] * days)
+        values[d] += row[count_column]
+    return {
+        'days': labels,
+        'series': series,
+        'totals': {key: sum(values) for key, values in series.items()}
+    }
+
+
+def _load_rollup_rows(table, dimension, count_column, start, terminal_id=None):
+    """
+    Every bucket since `start`, paged: days x terminals x dimension values
+    easily passes PostgREST's per-request row cap over a year.
+    """
+    rows = []
+    offset = 0
+    def fetch_page():
+        # Built fresh per attempt; ordered by the whole primary key so pages neither overlap nor skip rows
+        query = supabase.table(table).select(f'day, {dimension}, {count_column}') \
+            .gte('day', start.isoformat())
+        if terminal_id:
+            query = query.eq('terminal_id', terminal_id)
+        return query.order('day').order('terminal_id').order(dimension) \
+            .range(offset, offset + PAGE_SIZE - 1).execute()
+
+    while True:
+        page = resilient_call(fetch_page, retries=1)
+        rows.extend(page.data or [])
+        if len(page.data or []) < PAGE_SIZE:
+            return rows
+        offset += PAGE_SIZE
+
+
+# ---------------------------------------------------------------------------------------------------
+## Rollup time series API (admin dashboard)
+# ---------------------------------------------------------------------------------------------------
+
+@rollups_bp.route('/admin/rollups/<name>')
+@login_required(role='admin')
+def rollup_series(name):
+    if name not in SERIES:
+        return jsonify({'error': f"Unknown series '{name}'"}), 404
+    table, dimension, count_column = SERIES[name]
+
+    days = max(1, min(request.args.get('days', 30, type=int), MAX_DAYS))
+    terminal_id = request.args.get('terminal_id')
+    start = datetime.now(TIMETABLE_TZ).date() - timedelta(days=days - 1)
+
+    _refresh_if_due()
+    try:
+        rows = _load_rollup_rows(table, dimension, count_column, start, terminal_id)
+    except Exception as e:
+        return jsonify({'error': f"Error loading {name} rollups: {e}"}), 503
+
+    return jsonify(build_time_series(rows, dimension, count_column, start, days))
@@ -0,0 +1,366 @@
+from flask import current_app, session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SecureCookieSession
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from page_cache import LRUCache
+from redis_client import get_redis
+
+# --- Server-side sessions ---
+# The session cookie holds only a random id; the session itself lives in a
+# backend chosen by SESSION_BACKEND: 'memory' or 'sqlite' for a single node,
+# 'redis' (REDIS_URL) for several, or 'auto' for Redis when configured and
+# SQLite otherwise. Sessions are indexed by user_id, so one account's
+# sessions can be revoked without touching anyone else's. A small LRU per
+# worker saves a backend read on most requests; a revocation made by another
+# worker takes effect here within SESSION_CACHE_TTL seconds. Only a new or
+# rotated id creates a stored session; saving an existing one is an update
+# that fails once the session is gone, so a revoked session never comes back.
+# If the backend cannot be read, the request runs without a session and
+# nothing is saved, so the cookie survives the outage.
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'auto')
+SESSION_SQLITE_PATH = os.getenv('SESSION_SQLITE_PATH', 'sessions.db')
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 1024))
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', 5))
+SESSION_TOUCH_INTERVAL = 300   # seconds between expiry refreshes of an unchanged session
+SESSION_PURGE_INTERVAL = 600   # seconds between sweeps of expired sessions (memory/SQLite)
+SID_BYTES = 16                 # 22-character cookie value
+
+serializer = TaggedJSONSerializer()
+
+
+class ServerSession(SecureCookieSession):
+    """A session dict that knows its id and when it was last written."""
+
+    def __init__(self, initial=None, sid=None, written_at=0.0):
+        super().__init__(initial)
+        self.sid = sid
+        self.written_at = written_at
+        self.rotate = False
+        self.stale_sid = None  # cookie id that matched no stored session
+        self.unavailable = False  # the backend could not be read; never saved
+        self.loaded_user_id = self.get('user_id')
+
+
+class MemoryBackend:
+    """Sessions in this process only; lost on restart."""
+
+    def __init__(self):
+        self.sessions = {}  # sid -> (user_id, expires_at, written_at, payload)
+        self.by_user = {}   # user_id -> {sid, ...}
+        self.lock = threading.Lock()
+
+    def _remove(self, sid):
+        record = self.sessions.pop(sid, None)
+        if record and record[0] in self.by_user:
+            self.by_user[record[0]].discard(sid)
+            if not self.by_user[record[0]]:
+                del self.by_user[record[0]]
+
+    def load(self, sid):
+        with self.lock:
+            record = self.sessions.get(sid)
+            if record is None or record[1] < time.time():
+                return None
+            return record[3], record[2]
+
+    def create(self, sid, user_id, payload, ttl):
+        now = time.time()
+        with self.lock:
+            self.sessions[sid] = (user_id, now + ttl, now, payload)
+            if user_id:
+                self.by_user.setdefault(user_id, set()).add(sid)
+
+    def update(self, sid, user_id, payload, ttl):
+        now = time.time()
+        with self.lock:
+            record = self.sessions.get(sid)
+            if record is None or record[1] < now:
+                return False
+            self.sessions[sid] = (record[0], now + ttl, now, payload)
+            return True
+
+    def delete(self, sid):
+        with self.lock:
+            self._remove(sid)
+
+    def revoke_user(self, user_id, keep=None):
+        with self.lock:
+            sids = [sid for sid in self.by_user.get(user_id, ()) if sid != keep]
+            for sid in sids:
+                self._remove(sid)
+            return sids
+
+    def purge_expired(self):
+        now = time.time()
+        with self.lock:
+            for sid in [sid for sid, record in self.sessions.items() if record[1] < now]:
+                self._remove(sid)
+
+
+class SQLiteBackend:
+    """Sessions in a local SQLite file, shared by the workers on one machine."""
+
+    def __init__(self, path=SESSION_SQLITE_PATH):
+        self.path = path
+        self.local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                create table if not exists sessions (
+                    sid text primary key,
+                    user_id text,
+                    expires_at real not null,
+                    written_at real not null,
+                    payload text not null
+                )
+            """)
+            conn.execute("create index if not exists sessions_user_idx on sessions (user_id)")
+            self.local.conn = conn
+        return conn
+
+    def load(self, sid):
+        return self._connect().execute(
+            "select payload, written_at from sessions where sid = ? and expires_at > ?", (sid, time.time())
+        ).fetchone()
+
+    def create(self, sid, user_id, payload, ttl):
+        now = time.time()
+        self._connect().execute(
+            "insert into sessions (sid, user_id, expires_at, written_at, payload) values (?, ?, ?, ?, ?)",
+            (sid, user_id, now + ttl, now, payload)
+        )
+
+    def update(self, sid, user_id, payload, ttl):
+        now = time.time()
+        return self._connect().execute(
+            "update sessions set expires_at = ?, written_at = ?, payload = ? where sid = ? and expires_at > ?",
+            (now + ttl, now, payload, sid, now)
+        ).rowcount > 0
+
+    def delete(self, sid):
+        self._connect().execute("delete from sessions where sid = ?", (sid,))
+
+    def revoke_user(self, user_id, keep=None):
+        conn = self._connect()
+        conn.execute("begin immediate")
+        try:
+            sids = [row[0] for row in conn.execute(
+                "select sid from sessions where user_id = ? and sid != ?", (user_id, keep or '')
+            )]
+            conn.execute("delete from sessions where user_id = ? and sid != ?", (user_id, keep or ''))
+            conn.execute("commit")
+        except Exception:
+            conn.execute("rollback")
+            raise
+        return sids
+
+    def purge_expired(self):
+        self._connect().execute("delete from sessions where expires_at < ?", (time.time(),))
+
+
+class RedisBackend:
+    """Sessions in Redis (REDIS_URL), shared by every node; Redis expires them."""
+
+    def _client(self):
+        client = get_redis()
+        if client is None:
+            raise RuntimeError("SESSION_BACKEND=redis but REDIS_URL is not configured")
+        return client
+
+    def load(self, sid):
+        raw = self._client().get(f"session:{sid}")
+        if raw is None:
+            return None
+        record = json.loads(raw)
+        return record['p'], record['w']
+
+    def create(self, sid, user_id, payload, ttl):
+        client = self._client()
+        pipe = client.pipeline()
+        pipe.set(f"session:{sid}", json.dumps({'u': user_id, 'w': time.time(), 'p': payload}), ex=int(ttl))
+        if user_id:
+            pipe.sadd(f"user_sessions:{user_id}", sid)
+            pipe.expire(f"user_sessions:{user_id}", int(ttl))
+        pipe.execute()
+
+    def update(self, sid, user_id, payload, ttl):
+        client = self._client()
+        # XX: only overwrite a session that still exists
+        updated = client.set(f"session:{sid}", json.dumps({'u': user_id, 'w': time.time(), 'p': payload}),
+                             ex=int(ttl), xx=True)
+        if updated and user_id:
+            client.expire(f"user_sessions:{user_id}", int(ttl))
+        return bool(updated)
+
+    def delete(self, sid):
+        self._client().delete(f"session:{sid}")
+
+    def revoke_user(self, user_id, keep=None):
+        client = self._client()
+        sids = [sid.decode() for sid in client.smembers(f"user_sessions:{user_id}")]
+        sids = [sid for sid in sids if sid != keep]
+        if sids:
+            pipe = client.pipeline()
+            pipe.delete(*[f"session:{sid}" for sid in sids])
+            pipe.srem(f"user_sessions:{user_id}", *sids)
+            pipe.execute()
+        return sids
+
+    def purge_expired(self):
+        pass  # keys carry their own TTL
+
+
+BACKENDS = {'memory': MemoryBackend, 'sqlite': SQLiteBackend, 'redis': RedisBackend}
+
+
+class ServerSessionInterface(SessionInterface):
+    session_class = ServerSession
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.cache = LRUCache(SESSION_CACHE_SIZE)
+        self.purged_at = time.monotonic()
+
+    def _load(self, sid):
+        record = self.cache.get(sid)
+        if record is None:
+            record = self.backend.load(sid)
+            if record is not None:
+                self.cache.set(sid, tuple(record), SESSION_CACHE_TTL)
+        return record
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        try:
+            record = self._load(sid) if sid else None
+        except Exception as e:
+            # Not the same as "no such session": keep the cookie for when the backend is back
+            print(f"Error loading session: {e}")
+            session = self.session_class()
+            session.unavailable = True
+            return session
+        if record is None:
+            # Unknown, expired or revoked: start over (the stale cookie is dropped on save)
+            session = self.session_class()
+            session.stale_sid = sid
+            return session
+        payload, written_at = record
+        return self.session_class(serializer.loads(payload), sid=sid, written_at=written_at)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.unavailable:
+            return
+
+        if not session:
+            if session.sid:
+                self._delete(session.sid)
+            if session.sid or session.stale_sid:
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+                response.vary.add('Cookie')
+            return
+
+        now = time.time()
+        user_id = session.get('user_id')
+        # A session that changes hands always gets a new id (and a new row)
+        fresh = session.sid is None or session.rotate or user_id != session.loaded_user_id
+        touch = self.should_set_cookie(app, session) and now - session.written_at >= SESSION_TOUCH_INTERVAL
+        if not (fresh or session.modified or touch):
+            return
+
+        if fresh and session.sid:
+            self._delete(session.sid)
+            session.sid = None
+
+        user_id = str(user_id) if user_id else None
+        payload = serializer.dumps(dict(session))
+        ttl = app.permanent_session_lifetime.total_seconds()
+        try:
+            if session.sid is None:
+                session.sid = secrets.token_urlsafe(SID_BYTES)
+                self.backend.create(session.sid, user_id, payload, ttl)
+            elif not self.backend.update(session.sid, user_id, payload, ttl):
+                # Revoked or expired while this request ran: stay logged out
+                self.cache.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+                response.vary.add('Cookie')
+                return
+        except Exception as e:
+            print(f"Error saving session: {e}")
+            return
+        self.cache.set(session.sid, (payload, now), SESSION_CACHE_TTL)
+
+        response.set_cookie(
+            name, session.sid, expires=self.get_expiration_time(app, session),
+            httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite,
+            partitioned=self.get_cookie_partitioned(app)
+        )
+        response.vary.add('Cookie')
+        self._purge_if_due()
+
+    def _delete(self, sid):
+        self.cache.delete(sid)
+        try:
+            self.backend.delete(sid)
+        except Exception as e:
+            print(f"Error deleting session: {e}")
+
+    def _purge_if_due(self):
+        if time.monotonic() - self.purged_at < SESSION_PURGE_INTERVAL:
+            return
+        self.purged_at = time.monotonic()
+        try:
+            self.backend.purge_expired()
+        except Exception as e:
+            print(f"Error purging expired sessions: {e}")
+
+    def revoke_user(self, user_id, keep=None):
+        sids = self.backend.revoke_user(str(user_id), keep=keep)
+        for sid in sids:
+            self.cache.delete(sid)
+        return len(sids)
+
+
+def init_sessions(app):
+    """Installs the server-side session store chosen by app.config['SESSION_BACKEND']."""
+    app.config.setdefault('SESSION_BACKEND', SESSION_BACKEND)
+    choice = app.config['SESSION_BACKEND']
+    if choice == 'auto':
+        choice = 'redis' if get_redis() is not None else 'sqlite'
+    if choice not in BACKENDS:
+        raise ValueError(f"SESSION_BACKEND must be one of: auto, {', '.join(BACKENDS)}")
+    app.session_interface = ServerSessionInterface(BACKENDS[choice]())
+
+
+def regenerate_session():
+    """Moves the current session to a new id (call on login, against session fixation)."""
+    session.rotate = True
+    session.modified = True
+
+
+def revoke_user_sessions(user_id, keep_current=False):
+    """Logs user_id out everywhere, optionally except for this request's session. Returns the count."""
+    keep = getattr(session, 'sid', None) if keep_current else None
+    return current_app.session_interface.revoke_user(user_id, keep=keep)
@@ -0,0 +1,4 @@
+-- Image derivatives (thumbnail + web-optimised copy) for attachments.
+-- Rows uploaded before this change keep NULLs and fall back to file_url.
+alter table attachments add column if not exists thumbnail_url text;
+alter table attachments add column if not exists web_url text;
@@ -0,0 +1,38 @@
+-- Content-addressed upload storage used by blob_store.py.
+create table if not exists blobs (
+    sha256 text primary key,
+    path text not null,
+    size bigint not null,
+    content_type text,
+    created_at timestamptz not null default now(),
+    orphaned_at timestamptz
+);
+
+create table if not exists blob_refs (
+    id bigint generated always as identity primary key,
+    sha256 text not null,
+    owner text not null,
+    created_at timestamptz not null default now()
+);
+create index if not exists blob_refs_sha256_idx on blob_refs (sha256);
+create index if not exists blob_refs_owner_idx on blob_refs (owner);
+
+-- Two-phase garbage collection: unreferenced blobs are first marked as
+-- orphaned and only deleted once they have stayed unreferenced for the
+-- grace period. Returns the storage paths the caller should remove.
+create or replace function sweep_orphaned_blobs(grace_minutes integer default 60)
+returns table (path text)
+language plpgsql
+as $$
+begin
+    update blobs b set orphaned_at = now()
+    where b.orphaned_at is null
+      and not exists (select 1 from blob_refs r where r.sha256 = b.sha256);
+
+    return query
+    delete from blobs b
+    where b.orphaned_at < now() - make_interval(mins => grace_minutes)
+      and not exists (select 1 from blob_refs r where r.sha256 = b.sha256)
+    returning b.path;
+end;
+$$;
@@ -0,0 +1,76 @@
+-- Full-text search over complaints and feedbacks for the admin search page.
+-- The tsvector columns are generated, so Postgres keeps them in sync on every
+-- insert/update; the GIN indexes make matching independent of table size.
+alter table complaints add column if not exists search_vector tsvector
+    generated always as (
+        setweight(to_tsvector('english', coalesce(subject, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(message, '')), 'B')
+    ) stored;
+create index if not exists complaints_search_idx on complaints using gin (search_vector);
+
+alter table feedbacks add column if not exists search_vector tsvector
+    generated always as (
+        setweight(to_tsvector('english', coalesce(subject, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(message, '')), 'B')
+    ) stored;
+create index if not exists feedbacks_search_idx on feedbacks using gin (search_vector);
+
+-- Ranked, filtered, paginated search. kind is 'all', 'complaint' or
+-- 'feedback'; feedbacks have no status, so a status filter limits results to
+-- complaints. total_count is the number of matches before pagination.
+create or replace function search_submissions(
+    q text,
+    kind text default 'all',
+    status_filter text default null,
+    date_from timestamptz default null,
+    date_to timestamptz default null,
+    page_size integer default 20,
+    page_offset integer default 0
+)
+returns table (
+    kind text,
+    id text,
+    subject text,
+    snippet text,
+    status text,
+    submitted_at timestamptz,
+    rank real,
+    total_count bigint
+)
+language sql stable
+as $$
+    with query as (
+        select websearch_to_tsquery('english', q) as tsq
+    ),
+    matches as (
+        select 'complaint'::text as kind, c.id::text as id, c.subject, c.message,
+               c.status, c.submitted_at, ts_rank_cd(c.search_vector, query.tsq) as rank
+        from complaints c, query
+        where search_submissions.kind in ('all', 'complaint')
+          and c.search_vector @@ query.tsq
+          and (status_filter is null or c.status = status_filter)
+          and (date_from is null or c.submitted_at >= date_from)
+          and (date_to is null or c.submitted_at < date_to)
+        union all
+        select 'feedback'::text, f.id::text, f.subject, f.message,
+               null::text, f.submitted_at, ts_rank_cd(f.search_vector, query.tsq)
+        from feedbacks f, query
+        where search_submissions.kind in ('all', 'feedback')
+          and status_filter is null
+          and f.search_vector @@ query.tsq
+          and (date_from is null or f.submitted_at >= date_from)
+          and (date_to is null or f.submitted_at < date_to)
+    ),
+    page as (
+        select m.*, count(*) over () as total_count
+        from matches m
+        order by m.rank desc, m.submitted_at desc
+        limit page_size offset page_offset
+    )
+    -- Headlines are only built for the rows on the current page
+    select page.kind, page.id, page.subject,
+           ts_headline('english', page.message, query.tsq, 'StartSel=⟦, StopSel=⟧, MaxWords=35, MinWords=15'),
+           page.status, page.submitted_at, page.rank, page.total_count
+    from page, query
+    order by page.rank desc, page.submitted_at desc;
+$$;
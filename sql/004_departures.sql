@@ -0,0 +1,8 @@
+-- Scheduled departures per route, loaded by timetable.py. Routes with no
+-- rows here fall back to the default 08:00-20:00 half-hourly timetable.
+create table if not exists departures (
+    id bigint generated always as identity primary key,
+    route_id uuid not null references routes (id) on delete cascade,
+    departure_time time not null,
+    unique (route_id, departure_time)
+);
@@ -0,0 +1,6 @@
+-- The local outbox (outbox.py) replays inserts as upserts that ignore
+-- duplicates, keyed on a primary key generated by the app. These tables
+-- therefore need uuid primary keys (the app supplies them, as add_employee
+-- already does for users) and blob_refs needs a natural key.
+alter table blob_refs add constraint blob_refs_sha256_owner_key unique (sha256, owner);
+
@@ -0,0 +1,103 @@
+-- Daily rollups of accidents (by terminal and severity) and repairs (by
+-- terminal and priority), maintained incrementally by refresh_rollups().
+-- Each source row gets an ingest sequence; the refresh only aggregates rows
+-- past the last watermark, so its cost depends on new rows, not table size.
+alter table accidents add column if not exists ingest_seq bigint generated always as identity;
+alter table accidents add column if not exists ingested_at timestamptz not null default now();
+create index if not exists accidents_ingest_seq_idx on accidents (ingest_seq);
+
+alter table repairs add column if not exists ingest_seq bigint generated always as identity;
+alter table repairs add column if not exists ingested_at timestamptz not null default now();
+create index if not exists repairs_ingest_seq_idx on repairs (ingest_seq);
+
+create table if not exists accident_rollups (
+    terminal_id text not null,
+    day date not null,
+    severity text not null,
+    incidents integer not null default 0,
+    primary key (terminal_id, day, severity)
+);
+create index if not exists accident_rollups_day_idx on accident_rollups (day);
+
+create table if not exists repair_rollups (
+    terminal_id text not null,
+    day date not null,
+    priority text not null,
+    repairs integer not null default 0,
+    primary key (terminal_id, day, priority)
+);
+create index if not exists repair_rollups_day_idx on repair_rollups (day);
+
+create table if not exists rollup_watermarks (
+    name text primary key,
+    last_seq bigint not null default 0,
+    refreshed_at timestamptz
+);
+insert into rollup_watermarks (name) values ('accidents'), ('repairs') on conflict do nothing;
+
+-- Rows whose transaction may still be in flight are left for the next run:
+-- the batch stops just before the first row ingested within `settle`.
+-- Rows are bucketed by their local day in `tz` (rollups.py passes
+-- TIMETABLE_TZ). Timestamps are written in UTC (older local accident times
+-- are converted by 009_accident_time_utc.sql), so the ::timestamptz cast is
+-- exact whether the column is timestamp or timestamptz.
+drop function if exists refresh_rollups(interval);
+create or replace function refresh_rollups(
+    tz text default 'Asia/Kolkata',
+    settle interval default interval '30 seconds'
+)
+returns table (source text, buckets_updated bigint)
+language plpgsql
+as $$
+declare
+    wm bigint;
+    upper_seq bigint;
+    applied bigint;
+begin
+    -- accidents
+    select last_seq into wm from rollup_watermarks where name = 'accidents' for update;
+    select coalesce(min(a.ingest_seq) - 1, max_seq.v) into upper_seq
+    from (select coalesce(max(ingest_seq), wm) as v from accidents where ingest_seq > wm) max_seq
+    left join accidents a on a.ingest_seq > wm and a.ingested_at > now() - settle
+    group by max_seq.v;
+
+    insert into accident_rollups as r (terminal_id, day, severity, incidents)
+    select coalesce(a.terminal_id::text, 'unassigned'),
+           (a.accident_time::timestamptz at time zone tz)::date,
+           coalesce(a.severity, 'unknown'),
+           count(*)
+    from accidents a
+    where a.ingest_seq > wm and a.ingest_seq <= upper_seq
+    group by 1, 2, 3
+    on conflict (terminal_id, day, severity)
+    do update set incidents = r.incidents + excluded.incidents;
+    get diagnostics applied = row_count;
+
+    update rollup_watermarks set last_seq = greatest(wm, upper_seq), refreshed_at = now()
+    where name = 'accidents';
+    source := 'accidents'; buckets_updated := applied; return next;
+
+    -- repairs
+    select last_seq into wm from rollup_watermarks where name = 'repairs' for update;
+    select coalesce(min(p.ingest_seq) - 1, max_seq.v) into upper_seq
+    from (select coalesce(max(ingest_seq), wm) as v from repairs where ingest_seq > wm) max_seq
+    left join repairs p on p.ingest_seq > wm and p.ingested_at > now() - settle
+    group by max_seq.v;
+
+    insert into repair_rollups as r (terminal_id, day, priority, repairs)
+    select coalesce(p.terminal_id::text, 'unassigned'),
+           (p.reported_at::timestamptz at time zone tz)::date,
+           coalesce(p.priority, 'unknown'),
+           count(*)
+    from repairs p
+    where p.ingest_seq > wm and p.ingest_seq <= upper_seq
+    group by 1, 2, 3
+    on conflict (terminal_id, day, priority)
+    do update set repairs = r.repairs + excluded.repairs;
+    get diagnostics applied = row_count;
+
+    update rollup_watermarks set last_seq = greatest(wm, upper_seq), refreshed_at = now()
+    where name = 'repairs';
+    source := 'repairs'; buckets_updated := applied; return next;
+end;
+$$;
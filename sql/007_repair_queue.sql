@@ -0,0 +1,20 @@
+-- Repair work queue (employee_features.py). Pending repairs are read in
+-- priority-then-age order straight off a partial index per terminal, and
+-- claims/completions use a version column for optimistic concurrency.
+alter table repairs add column if not exists priority_rank smallint
+    generated always as (
+        case priority when 'critical' then 0 when 'high' then 1 when 'medium' then 2 when 'low' then 3 else 4 end
+    ) stored;
+alter table repairs add column if not exists version integer not null default 0;
+alter table repairs add column if not exists claimed_by uuid references users (id);
+alter table repairs add column if not exists claimed_at timestamptz;
+alter table repairs add column if not exists completed_at timestamptz;
+
+create index if not exists repairs_pending_queue_idx
+    on repairs (terminal_id, priority_rank, reported_at)
+    where status = 'pending';
+
+-- Repair attachments are stored as rows like feedback/complaint attachments
+-- instead of URLs appended to the description.
+alter table attachments add column if not exists repair_id uuid references repairs (id) on delete cascade;
+create index if not exists attachments_repair_id_idx on attachments (repair_id);
@@ -0,0 +1,4 @@
+-- Crossing time per route, used by timetable.py to find the connecting boat
+-- for each later leg of a multi-leg journey. Routes without a value are
+-- assumed to take timetable.DEFAULT_LEG_MINUTES.
+alter table routes add column if not exists duration_minutes smallint check (duration_minutes > 0);
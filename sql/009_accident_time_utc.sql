@@ -0,0 +1,25 @@
+-- accident_time used to be stored as the crew's local wall-clock time with
+-- no offset, so it was read back as UTC: shown shifted, and bucketed on the
+-- wrong day by refresh_rollups(). The app now writes UTC. Apply this before
+-- the app starts writing UTC times: the rows present now are marked as local
+-- time, converted once from Asia/Kolkata (change it if TIMETABLE_TZ differs),
+-- and the accident rollups are rebuilt from scratch on the next refresh.
+set timezone = 'UTC';
+
+-- Existing rows get true; rows inserted from now on get the new default
+alter table accidents add column if not exists accident_time_is_local boolean not null default true;
+alter table accidents alter column accident_time_is_local set default false;
+
+-- Works for timestamp and timestamptz columns alike with the session in UTC
+update accidents
+set accident_time = (accident_time::timestamptz at time zone 'UTC') at time zone 'Asia/Kolkata',
+    accident_time_is_local = false
+where accident_time_is_local and accident_time is not null;
+
+update accidents set accident_time_is_local = false where accident_time_is_local;
+
+begin;
+select 1 from rollup_watermarks where name = 'accidents' for update;
+truncate accident_rollups;
+update rollup_watermarks set last_seq = 0, refreshed_at = null where name = 'accidents';
+commit;
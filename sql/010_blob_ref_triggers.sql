@@ -0,0 +1,34 @@
+-- Rows that own uploads are only ever deleted outside the app (dashboard,
+-- SQL), so their blob_refs are dropped here rather than by the app. The
+-- trigger argument is the owner prefix blob_store.py writes, e.g.
+-- 'feedback' for 'feedback:<id>'. Unreferenced blobs are then collected by
+-- sweep_orphaned_blobs() after its grace period.
+create or replace function release_blob_refs()
+returns trigger
+language plpgsql
+as $$
+begin
+    delete from blob_refs where owner = tg_argv[0] || ':' || old.id::text;
+    return old;
+end;
+$$;
+
+drop trigger if exists feedbacks_release_blob_refs on feedbacks;
+create trigger feedbacks_release_blob_refs after delete on feedbacks
+    for each row execute function release_blob_refs('feedback');
+
+drop trigger if exists complaints_release_blob_refs on complaints;
+create trigger complaints_release_blob_refs after delete on complaints
+    for each row execute function release_blob_refs('complaint');
+
+drop trigger if exists accidents_release_blob_refs on accidents;
+create trigger accidents_release_blob_refs after delete on accidents
+    for each row execute function release_blob_refs('accident');
+
+drop trigger if exists repairs_release_blob_refs on repairs;
+create trigger repairs_release_blob_refs after delete on repairs
+    for each row execute function release_blob_refs('repair');
+
+drop trigger if exists certificates_release_blob_refs on certificates;
+create trigger certificates_release_blob_refs after delete on certificates
+    for each row execute function release_blob_refs('certificate');
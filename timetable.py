@@ -0,0 +1,200 @@
+from flask import Blueprint, request, jsonify
+from supabase import create_client, Client
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from array import array
+from bisect import bisect_left
+import threading
+import os
+
+from journey_planner import get_route_graph
+from resilience import client_options, resilient_call
+
+timetable_bp = Blueprint('timetable_bp', __name__)
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=client_options())
+
+# Departure times are local to the water metro, not the server
+TIMETABLE_TZ = ZoneInfo(os.getenv('TIMETABLE_TZ', 'Asia/Kolkata'))
+
+# Used for routes that have no rows in `departures` yet:
+# every 30 minutes from 08:00 to 20:00.
+DEFAULT_DEPARTURES = array('H', range(8 * 60, 20 * 60 + 1, 30))
+# Crossing time for routes without routes.duration_minutes, and the time
+# allowed to change boats at a transfer terminal
+DEFAULT_LEG_MINUTES = 30
+TRANSFER_MINUTES = 5
+PAGE_SIZE = 1000  # PostgREST's default max rows per request
+
+
+def parse_time(value):
+    """'HH:MM' or 'HH:MM:SS' -> minutes since midnight."""
+    hours, minutes = str(value).split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def format_time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class Timetable:
+    """
+    Departures held as sorted arrays of minutes since midnight: one array per
+    route, plus a merged array per origin terminal with a parallel array of
+    route indexes. Next-departure queries are a bisect plus a slice.
+    """
+
+    def __init__(self, routes, departures_by_route):
+        self.routes = routes
+        self.route_index = {str(r['id']): i for i, r in enumerate(routes)}
+
+        self.by_route = []
+        merged = {}
+        for i, r in enumerate(routes):
+            minutes = departures_by_route.get(str(r['id']))
+            minutes = array('H', sorted(minutes)) if minutes else DEFAULT_DEPARTURES
+            self.by_route.append(minutes)
+            merged.setdefault(str(r['origin_terminal_id']), []).extend((m, i) for m in minutes)
+
+        self.by_terminal = {}
+        for terminal_id, pairs in merged.items():
+            pairs.sort()
+            self.by_terminal[terminal_id] = (array('H', (m for m, _ in pairs)),
+                                             array('I', (i for _, i in pairs)))
+
+        all_minutes = set()
+        for minutes in self.by_route:
+            all_minutes.update(minutes)
+        self.slots = [format_time(m) for m in sorted(all_minutes or DEFAULT_DEPARTURES)]
+
+    def next_departures(self, terminal_id, after_minute, limit=5):
+        """The next `limit` departures from a terminal at or after `after_minute` today."""
+        entry = self.by_terminal.get(str(terminal_id))
+        if not entry:
+            return []
+        minutes, route_ids = entry
+        start = bisect_left(minutes, after_minute)
+        return [(format_time(minutes[k]), self.routes[route_ids[k]])
+                for k in range(start, min(start + limit, len(minutes)))]
+
+    def next_route_departure(self, route_id, after_minute):
+        """Next departure time ('HH:MM') of a single route today, or None."""
+        i = self.route_index.get(str(route_id))
+        if i is None:
+            return None
+        minutes = self.by_route[i]
+        k = bisect_left(minutes, after_minute)
+        return format_time(minutes[k]) if k < len(minutes) else None
+
+    def connecting_departures(self, legs, earliest):
+        """
+        Departure times ('HH:MM') for each leg of a journey starting no
+        earlier than `earliest`: the first leg takes its route's first boat
+        at or after it (or `earliest` itself if the route has no timetable),
+        and every later leg the first boat after the previous one arrives.
+        None if a connection misses the last boat.
+        """
+        first_departure = earliest
+        if self.route_index.get(str(legs[0]['id'])) is not None:
+            first_departure = self.next_route_departure(legs[0]['id'], parse_time(earliest))
+            if first_departure is None:
+                return None
+        times = [first_departure]
+        departure = parse_time(first_departure)
+        for previous, leg in zip(legs, legs[1:]):
+            arrival = departure + (previous.get('duration_minutes') or DEFAULT_LEG_MINUTES)
+            next_time = self.next_route_departure(leg['id'], arrival + TRANSFER_MINUTES)
+            if next_time is None:
+                return None
+            times.append(next_time)
+            departure = parse_time(next_time)
+        return times
+
+
+# --- Timetable cache ---
+# Rebuilt whenever the routes cache in journey_planner refreshes, so routes
+# and departures never disagree.
+_cache = {'graph': None, 'timetable': None, 'departures': None}
+_cache_lock = threading.Lock()
+
+
+def _load_departure_rows():
+    rows = []
+    start = 0
+    while True:
+        page = resilient_call(
+            lambda: supabase.table('departures').select('route_id, departure_time')
+                .order('id').range(start, start + PAGE_SIZE - 1).execute(),
+            retries=2
+        )
+        rows.extend(page.data or [])
+        if len(page.data or []) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+
+def _load_departures():
+    try:
+        rows = _load_departure_rows()
+    except Exception as e:
+        if _cache['departures'] is not None:
+            print(f"Error loading departures, keeping the last good timetable: {e}")
+            return _cache['departures']
+        print(f"Error loading departures, using default timetable: {e}")
+        return {}
+    departures = {}
+    for row in rows:
+        departures.setdefault(str(row['route_id']), []).append(parse_time(row['departure_time']))
+    _cache['departures'] = departures
+    return departures
+
+
+def get_timetable():
+    graph = get_route_graph()
+    if _cache['graph'] is graph:
+        return _cache['timetable']
+    with _cache_lock:
+        if _cache['graph'] is not graph:
+            _cache['timetable'] = Timetable(graph.routes, _load_departures())
+            _cache['graph'] = graph
+        return _cache['timetable']
+
+
+def current_minute():
+    now = datetime.now(TIMETABLE_TZ)
+    return now.hour * 60 + now.minute
+
+
+# ---------------------------------------------------------------------------------------------------
+## Departures API
+# ---------------------------------------------------------------------------------------------------
+
+@timetable_bp.route('/api/departures')
+def next_departures():
+    terminal_id = request.args.get('terminal_id')
+    after = request.args.get('after')
+    limit = min(request.args.get('limit', 5, type=int), 50)
+
+    if not terminal_id:
+        return jsonify({'error': "'terminal_id' is required"}), 400
+    try:
+        after_minute = parse_time(after) if after else current_minute()
+    except ValueError:
+        return jsonify({'error': "'after' must be HH:MM"}), 400
+
+    try:
+        departures = get_timetable().next_departures(terminal_id, after_minute, limit)
+    except Exception as e:
+        return jsonify({'error': f"Error loading timetable: {e}"}), 503
+
+    return jsonify({
+        'terminal_id': terminal_id,
+        'departures': [{
+            'time': time_str,
+            'route_id': route['id'],
+            'route_name': route.get('name'),
+            'destination_terminal_id': route['destination_terminal_id']
+        } for time_str, route in departures]
+    })